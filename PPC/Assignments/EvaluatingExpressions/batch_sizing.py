@@ -0,0 +1,83 @@
+import time
+
+BATCH_MEMORY_BYTES = 256 * 1024 ** 2
+MIN_BATCH = 1
+MAX_BATCH = 4096
+START_BATCH = 32
+TOLERANCE = 0.05
+
+# Share of a memory budget given to the cache of common subexpressions when
+# an engine keeps one; the batches get the rest.
+CSE_CACHE_SHARE = 0.5
+
+# Row-sized arrays held per expression of a batch: its prediction, the copy
+# made by stack, and the difference and square computed for the error.
+ARRAYS_PER_EXPRESSION = 4
+
+
+def max_batch_size(n_rows, max_depth, itemsize=8, budget_bytes=BATCH_MEMORY_BYTES):
+    """Largest batch whose predictions and error temporaries fit in the budget,
+    after reserving one temporary per tree level for the expression being
+    evaluated."""
+    row_bytes = max(1, n_rows) * itemsize
+    free = budget_bytes - max_depth * row_bytes
+    size = free // (ARRAYS_PER_EXPRESSION * row_bytes)
+    return max(MIN_BATCH, min(MAX_BATCH, size))
+
+
+def split_budget(budget_bytes=BATCH_MEMORY_BYTES, cse=True):
+    """(batch bytes, CSE cache bytes) of a budget that bounds the batch
+    temporaries and the cached subexpression values together."""
+    cache_bytes = int(budget_bytes * CSE_CACHE_SHARE) if cse else 0
+    return budget_bytes - cache_bytes, cache_bytes
+
+
+class AdaptiveBatcher:
+    """Splits n items into batches whose size is tuned while running.
+
+    Starts at START_BATCH (or the memory bound, if lower) and doubles the size
+    while the time per item keeps dropping by more than TOLERANCE. When a
+    larger batch is slower per item it goes back to the previous size and
+    stays there. The size never exceeds max_size. sizes keeps every batch
+    size used, in order.
+
+    sync is called before reading the clock, so asynchronous devices are
+    timed on completed work."""
+
+    def __init__(self, max_size, start=START_BATCH, sync=None):
+        self.max_size = max_size
+        self.size = min(start, max_size)
+        self.sync = sync
+        self.sizes = []
+        self.growing = True
+        self.last_size = None
+        self.last_per_item = None
+
+    def batches(self, n):
+        start = 0
+        while start < n:
+            stop = min(start + self.size, n)
+            self.sizes.append(stop - start)
+            t0 = time.perf_counter()
+            yield start, stop
+            if self.sync is not None:
+                self.sync()
+            self.record(time.perf_counter() - t0, stop - start)
+            start = stop
+
+    def record(self, elapsed, size):
+        # A short final batch says nothing about the chosen size.
+        if not self.growing or size < self.size:
+            return
+        per_item = elapsed / size
+        if self.last_per_item is not None and per_item > self.last_per_item * (1 - TOLERANCE):
+            if per_item > self.last_per_item * (1 + TOLERANCE):
+                self.size = self.last_size
+            self.growing = False
+            return
+        self.last_size = self.size
+        self.last_per_item = per_item
+        if self.size >= self.max_size:
+            self.growing = False
+        else:
+            self.size = min(self.max_size, self.size * 2)
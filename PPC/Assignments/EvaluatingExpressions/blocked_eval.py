@@ -0,0 +1,51 @@
+import numpy as np
+
+DEFAULT_CACHE_BYTES = 1024 * 1024
+MIN_BLOCK_ROWS = 1024
+
+
+def cache_size_bytes(level=2):
+    """Size of the per-core data cache, read from sysfs when available."""
+    path = f"/sys/devices/system/cpu/cpu0/cache/index{level}/size"
+    try:
+        with open(path) as f:
+            size = f.read().strip()
+    except OSError:
+        return DEFAULT_CACHE_BYTES
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def choose_block_rows(n_cols, max_depth, itemsize=8, cache_bytes=None):
+    """Rows per block so that the input slices, one temporary per tree level,
+    the target and the error buffer all fit in cache together."""
+    if cache_bytes is None:
+        cache_bytes = cache_size_bytes()
+    arrays = n_cols + max_depth + 2
+    rows = cache_bytes // (arrays * itemsize)
+    return max(MIN_BLOCK_ROWS, rows - rows % MIN_BLOCK_ROWS)
+
+
+def blocked_sse(kernels, X, y, block_rows, on_block=None):
+    """Sum of squared errors per kernel, walking the rows one block at a time.
+
+    Only block-sized temporaries are ever allocated, so peak memory does not
+    depend on the number of rows."""
+    n_rows = len(y)
+    sse = np.zeros(len(kernels))
+    diff = np.empty(block_rows, dtype=y.dtype)
+
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        Xb = {c: v[start:stop] for c, v in X.items()}
+        yb = y[start:stop]
+        d = diff[:stop - start]
+        for i, kernel in enumerate(kernels):
+            np.subtract(kernel(Xb), yb, out=d)
+            sse[i] += np.dot(d, d)
+        if on_block is not None:
+            on_block()
+
+    return sse
@@ -0,0 +1,116 @@
+import time
+
+STARTED = time.perf_counter_ns()
+
+import argparse
+import sys
+
+HEAVY_MODULES = ("numpy", "pandas", "torch")
+
+
+def startup_report():
+    """Seconds from the start of this module to now, and which of the heavy
+    modules were imported on the way."""
+    seconds = (time.perf_counter_ns() - STARTED) / 1e9
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    return f"Startup: {seconds:.3f}s (imported {', '.join(loaded) or 'none'} of {', '.join(HEAVY_MODULES)})"
+
+
+def generate(args, rest):
+    import generate_inputs
+    print(startup_report())
+    generate_inputs.main(rest)
+
+
+def benchmark(args, rest):
+    import sequential_parallel_benchmark
+    print(startup_report())
+    sequential_parallel_benchmark.main(rest)
+
+
+def search(args, rest):
+    import symbolic_regression
+    print(startup_report())
+    symbolic_regression.main(rest)
+
+
+def score(args, rest):
+    import fnmatch
+    import glob
+    import os
+
+    from sequential_parallel_benchmark import ENGINES, PRECISION_ENGINES, engine_kwargs
+    from precision import PRECISIONS
+    from graph_compile import GRAPH_MODES
+    from cost_model import MODEL_FILE
+
+    if rest:
+        args.parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    # Checked here rather than with choices, so that parsing the command line
+    # does not import the benchmark module.
+    engines = {e[0]: e for e in ENGINES}
+    if args.engine not in engines:
+        args.parser.error(f"unknown engine {args.engine} (choose from {', '.join(engines)})")
+    if args.precision not in PRECISIONS:
+        args.parser.error(f"unknown precision {args.precision} (choose from {', '.join(PRECISIONS)})")
+    if args.graph_mode is not None and args.graph_mode not in GRAPH_MODES:
+        args.parser.error(f"unknown graph mode {args.graph_mode} (choose from {', '.join(GRAPH_MODES)})")
+    key, label, fn, kwargs, detail = engines[args.engine]
+    if args.precision != "float64" and key not in PRECISION_ENGINES:
+        sys.exit(f"The {key} engine only runs in float64")
+    if key == "auto" and not os.path.exists(MODEL_FILE):
+        sys.exit(f"No {MODEL_FILE}: run 'python cli.py benchmark --calibrate' first")
+    kwargs = engine_kwargs(key, kwargs, args.precision, args.top_k, graph_mode=args.graph_mode,
+                           cse=not args.no_cse)
+
+    test_files = sorted(f for f in glob.glob("test_cases/data_*.csv")
+                        if fnmatch.fnmatch(os.path.basename(f)[5:-4], args.filter))
+    if not test_files:
+        sys.exit(f"No test case matches '{args.filter}' in test_cases/ (run 'python cli.py generate')")
+
+    print(startup_report())
+    for csv_file in test_files:
+        name = os.path.basename(csv_file)[5:-4]
+        functions_file = csv_file.replace("data_", "functions_").replace(".csv", ".txt")
+        result = fn(csv_file, functions_file, **kwargs)
+        extra = f" ({detail(result)})" if detail else ""
+        print(f"{name}: {label} {result[0]:.4f}s, best {result[1]:.6e}  {result[2]}{extra}")
+        if args.top_k > 1 and len(result) > 3 and isinstance(result[3], list):
+            for rank, (err, expr) in enumerate(result[3], 1):
+                print(f"  {rank:>3}. {err:.6e}  {expr}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expression evaluation: generate test cases, score, benchmark, search")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("generate", help="generate the test cases (options of generate_inputs.py follow)",
+                            add_help=False)
+    p.set_defaults(run=generate)
+
+    p = commands.add_parser("benchmark", add_help=False,
+                            help="benchmark the engines (options of sequential_parallel_benchmark.py follow, "
+                                 "e.g. --engine cpu --filter 'small_*')")
+    p.set_defaults(run=benchmark)
+
+    p = commands.add_parser("search", add_help=False,
+                            help="symbolic regression on a test case (options of symbolic_regression.py follow)")
+    p.set_defaults(run=search)
+
+    p = commands.add_parser("score", help="score the test cases with one engine, once")
+    p.add_argument("--engine", default="cpu", help="a key of ENGINES, e.g. cpu, gpu, fused_numpy or auto")
+    p.add_argument("--precision", default="float64", help="float64 or float32")
+    p.add_argument("--filter", default="*", metavar="PATTERN", help="glob pattern of test case names")
+    p.add_argument("--top-k", type=int, default=1)
+    p.add_argument("--graph-mode", default=None, help="trace or compile, for the gpu_graph engine")
+    p.add_argument("--no-cse", action="store_true", help="do not share common subexpressions (cpu and gpu)")
+    p.set_defaults(run=score, parser=p)
+
+    # generate, benchmark and search pass the options they do not know on to the
+    # main() of their module.
+    args, rest = parser.parse_known_args(argv)
+    args.run(args, rest)
+
+
+if __name__ == "__main__":
+    main()
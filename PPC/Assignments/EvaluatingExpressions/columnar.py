@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def columnar_dir(csv_file):
+    """test_cases/data_x.csv is stored in columnar form as test_cases/data_x/."""
+    return os.path.splitext(csv_file)[0]
+
+
+def create_columnar(directory, columns, n_rows, dtype=np.float64):
+    """Creates the .npy files and the manifest of an n_rows columnar dataset
+    and returns writable memory maps, so it can be filled chunk by chunk."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "rows": n_rows,
+        "columns": list(columns),
+        "dtype": np.dtype(dtype).name
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return {c: np.lib.format.open_memmap(os.path.join(directory, f"{c}.npy"), mode="w+",
+                                         dtype=dtype, shape=(n_rows,))
+            for c in columns}
+
+
+def write_columnar(df, directory):
+    """One .npy file per column plus a manifest with the row count, column
+    order and dtype."""
+    columns = list(df.columns)
+    out = create_columnar(directory, columns, len(df), df[columns[0]].dtype)
+    for c in columns:
+        out[c][:] = df[c].values
+        out[c].flush()
+
+
+def append_columnar(directory, rows):
+    """Grows a columnar dataset by rows, a dict of equally long arrays. The
+    .npy files have a fixed shape, so every column is written to a new file
+    that then replaces the old one."""
+    old = load_columnar(directory)
+    columns = list(old)
+    n_old = len(old[columns[0]])
+    n_new = len(rows[columns[0]])
+    tmp = directory + ".tmp"
+    out = create_columnar(tmp, columns, n_old + n_new, old[columns[0]].dtype)
+    for c in columns:
+        out[c][:n_old] = old[c]
+        out[c][n_old:] = rows[c]
+        out[c].flush()
+    del old, out
+    for name in [f"{c}.npy" for c in columns] + [MANIFEST]:
+        os.replace(os.path.join(tmp, name), os.path.join(directory, name))
+    os.rmdir(tmp)
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def load_columnar(directory, columns=None):
+    """Maps the columns (every column by default) read-only, without copying
+    them into memory."""
+    manifest = read_manifest(directory)
+    return {c: np.load(os.path.join(directory, f"{c}.npy"), mmap_mode="r")
+            for c in manifest["columns"] if columns is None or c in columns}
+
+
+def load_columns(csv_file, dtype=None, columns=None):
+    """Columns of a test case as a dict of arrays, memory-mapped from the
+    columnar copy when there is one and parsed from the CSV otherwise.
+    Columns stored with another dtype than dtype (float64 by default) are
+    converted once. A columnar copy stored narrower than that
+    (generate_inputs.py --dtype float32) is only used if there is no CSV,
+    since widening it would not bring back the rounded digits.
+    With columns, only those are read, in the order of the dataset."""
+    directory = columnar_dir(csv_file)
+    dtype = np.dtype(dtype or np.float64)
+    columnar = os.path.exists(os.path.join(directory, MANIFEST))
+    if columnar and os.path.exists(csv_file):
+        columnar = np.dtype(read_manifest(directory)["dtype"]).itemsize >= dtype.itemsize
+    if columnar:
+        X = load_columnar(directory, columns)
+    else:
+        import pandas as pd
+        df = pd.read_csv(csv_file, usecols=None if columns is None else lambda c: c in columns)
+        X = {c: df[c].values for c in df.columns}
+    return {c: np.asarray(v, dtype=dtype) for c, v in X.items()}
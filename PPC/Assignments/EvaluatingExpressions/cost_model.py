@@ -0,0 +1,124 @@
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from expressions import parse, depth
+from columnar import load_columns
+
+MODEL_FILE = "cost_model.json"
+
+# Synthetic workloads timed by calibrate(): (rows, functions, depth).
+CALIBRATION_GRID = [
+    (1_000, 50, 2),
+    (1_000, 400, 4),
+    (10_000, 100, 3),
+    (10_000, 400, 2),
+    (50_000, 100, 4),
+    (50_000, 400, 3),
+    (200_000, 50, 3),
+]
+
+TERMS = ["constant", "functions*depth", "rows*functions*depth"]
+
+
+def features(rows, functions, mean_depth):
+    """Terms of the cost model: a fixed cost, a per-node cost (parsing,
+    compiling and dispatching one operation) and a per-node-per-row cost."""
+    nodes = functions * mean_depth
+    return np.array([1.0, nodes, rows * nodes])
+
+
+def workload(csv_file, functions_file):
+    """(rows, functions, mean depth) of a test case."""
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    rows = len(load_columns(csv_file, columns={"y"})["y"])
+    mean_depth = sum(depth(parse(f)) for f in funs) / len(funs)
+    return rows, len(funs), max(1.0, mean_depth)
+
+
+def fit(samples):
+    """Least-squares coefficients of features -> seconds, weighting every sample
+    by 1 / seconds so small and large workloads count alike. Negative
+    coefficients are dropped and the rest refitted, so predictions never
+    decrease with more work."""
+    A = np.array([features(*w) for w, _ in samples])
+    t = np.array([s for _, s in samples])
+    active = np.ones(len(TERMS), dtype=bool)
+    coef = np.zeros(len(TERMS))
+    while active.any():
+        sol, *_ = np.linalg.lstsq(A[:, active] / t[:, None], np.ones(len(t)), rcond=None)
+        if (sol >= 0).all():
+            coef[active] = sol
+            break
+        active[np.flatnonzero(active)[np.argmin(sol)]] = False
+    return coef
+
+
+class CostModel:
+    """Predicted evaluation time of each engine as a linear function of the
+    workload features, with coefficients measured on this machine."""
+
+    def __init__(self, coefficients, machine=None):
+        self.coefficients = {k: np.asarray(c, dtype=float) for k, c in coefficients.items()}
+        self.machine = machine or {}
+
+    def predict(self, engine, rows, functions, mean_depth):
+        return float(self.coefficients[engine] @ features(rows, functions, mean_depth))
+
+    def choose(self, rows, functions, mean_depth, engines=None):
+        """Engine predicted to be fastest, and its predicted time in seconds."""
+        engines = [e for e in (engines or self.coefficients) if e in self.coefficients]
+        best = min(engines, key=lambda e: self.predict(e, rows, functions, mean_depth))
+        return best, self.predict(best, rows, functions, mean_depth)
+
+    def save(self, path=MODEL_FILE):
+        with open(path, "w") as f:
+            json.dump({
+                "terms": TERMS,
+                "machine": self.machine,
+                "coefficients": {k: c.tolist() for k, c in self.coefficients.items()}
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["coefficients"], data.get("machine"))
+
+
+def machine_info(device):
+    return {
+        "node": platform.node(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "device": str(device)
+    }
+
+
+def calibrate(engines, device, grid=CALIBRATION_GRID, repeats=2, log=print):
+    """Times every engine (a dict key -> benchmark function) on synthetic test
+    cases of the grid and fits one cost model per engine. Each engine is run
+    once to warm up and then repeats times; the fastest run is kept."""
+    from generate_inputs import generate_config
+
+    samples = {key: [] for key in engines}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows, functions, tree_depth in grid:
+            name = f"calib_{rows}_{functions}_{tree_depth}"
+            generate_config((rows, functions, tree_depth, name), out_dir=tmp)
+            csv_file = os.path.join(tmp, f"data_{name}.csv")
+            functions_file = os.path.join(tmp, f"functions_{name}.txt")
+            w = workload(csv_file, functions_file)
+            for key, fn in engines.items():
+                fn(csv_file, functions_file)
+                best = min(fn(csv_file, functions_file)[0] for _ in range(repeats))
+                samples[key].append((w, best))
+            log(f"  calibrated {rows:,} rows x {functions:,} functions, depth {tree_depth}")
+
+    model = CostModel({key: fit(s) for key, s in samples.items()}, machine_info(device))
+    model.machine["calibrated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return model
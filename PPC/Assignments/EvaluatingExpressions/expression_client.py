@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import json
+import socket
+
+from expression_server import SOCKET_PATH
+
+
+class ServerError(Exception):
+    """The server could not score a request (bad expression, missing dataset)."""
+
+
+def parse_address(address):
+    """Reads host:port as a TCP address and anything else as a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+class ExpressionClient:
+    """Blocking client: one request at a time over one connection."""
+
+    def __init__(self, address=SOCKET_PATH):
+        target = parse_address(address)
+        if isinstance(target, tuple):
+            self.sock = socket.create_connection(target)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(target)
+        self.file = self.sock.makefile("rwb")
+        self.ids = itertools.count()
+
+    def request(self, **request):
+        request["id"] = next(self.ids)
+        self.file.write((json.dumps(request) + "\n").encode())
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise ServerError(response["error"])
+        return response
+
+    def score(self, dataset, expressions):
+        """MSE of each expression on the dataset (a test case CSV path, as seen
+        by the server), in the order given."""
+        return self.request(dataset=dataset, expressions=list(expressions))["mse"]
+
+    def stats(self):
+        return self.request(stats=True)["stats"]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncExpressionClient:
+    """asyncio client that pipelines requests over one connection: score()
+    can be awaited from many tasks at once and the responses are matched to
+    them by id."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, address=SOCKET_PATH):
+        target = parse_address(address)
+        if isinstance(target, tuple):
+            reader, writer = await asyncio.open_connection(*target)
+        else:
+            reader, writer = await asyncio.open_unix_connection(target)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while line := await self.reader.readline():
+            response = json.loads(line)
+            future = self.waiting.pop(response["id"], None)
+            if future is None:
+                # An error about a line that could not be parsed as a request.
+                continue
+            if "error" in response:
+                future.set_exception(ServerError(response["error"]))
+            else:
+                future.set_result(response)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, **request):
+        request["id"] = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request["id"]] = future
+        self.writer.write((json.dumps(request) + "\n").encode())
+        await self.writer.drain()
+        return await future
+
+    async def score(self, dataset, expressions):
+        return (await self.request(dataset=dataset, expressions=list(expressions)))["mse"]
+
+    async def stats(self):
+        return (await self.request(stats=True))["stats"]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,104 @@
+import operator
+from collections import OrderedDict
+
+BINARY_FUNS = {
+    "+": operator.add,
+    "-": operator.sub
+}
+
+# Default budget of the cache of common subexpression values.
+CSE_CACHE_BYTES = 512 * 1024 ** 2
+
+
+def nbytes(value):
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    return value.element_size() * value.nelement()
+
+
+class LRUCache:
+    """Keeps intermediate results by node id, evicting the least recently used
+    entries once the total size goes over max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.used_bytes += size
+        while self.used_bytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.used_bytes -= nbytes(old)
+
+    def clear(self):
+        self.entries.clear()
+        self.used_bytes = 0
+
+
+class ExpressionDAG:
+    """Hash-conses a population of ASTs so that every distinct subtree is a
+    single node shared by all the expressions that contain it."""
+
+    def __init__(self):
+        self.nodes = []
+        self.uses = []
+        self.index = {}
+        self.roots = []
+
+    def intern(self, node):
+        node_id = self.index.get(node)
+        if node_id is None:
+            kind = node[0]
+            if kind == "col":
+                key = node
+            elif kind == "un":
+                key = ("un", node[1], self.intern(node[2]))
+            else:
+                key = ("bin", node[1], self.intern(node[2]), self.intern(node[3]))
+            node_id = len(self.nodes)
+            self.index[node] = node_id
+            self.nodes.append(key)
+            self.uses.append(0)
+        self.uses[node_id] += 1
+        return node_id
+
+    def add(self, node):
+        root = self.intern(node)
+        self.roots.append(root)
+        return root
+
+    def evaluate(self, node_id, X, ops, cache):
+        node = self.nodes[node_id]
+        if node[0] == "col":
+            return X[node[1]]
+
+        value = cache.get(node_id) if self.uses[node_id] > 1 else None
+        if value is not None:
+            return value
+
+        if node[0] == "un":
+            value = ops[node[1]](self.evaluate(node[2], X, ops, cache))
+        else:
+            left = self.evaluate(node[2], X, ops, cache)
+            right = self.evaluate(node[3], X, ops, cache)
+            value = BINARY_FUNS[node[1]](left, right)
+
+        if self.uses[node_id] > 1:
+            cache.put(node_id, value)
+        return value
@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from columnar import load_columns
+from expressions import parse, depth, referenced_columns
+from expression_dag import ExpressionDAG, LRUCache
+from batch_sizing import BATCH_MEMORY_BYTES, max_batch_size, split_budget
+from fused_codegen import torch_fused_ops
+
+SOCKET_PATH = "expression_server.sock"
+COALESCE_SECONDS = 0.002
+MAX_COALESCED = 4096
+
+
+class Dataset:
+    """Columns of one test case, resident on the device, and the queue of
+    requests waiting to be scored against it."""
+
+    def __init__(self, csv_file, torch, device):
+        columns = load_columns(csv_file)
+        self.X = {c: torch.tensor(columns[c], dtype=torch.float64, device=device)
+                  for c in columns}
+        self.y = self.X["y"]
+        self.pending = []
+        self.wakeup = asyncio.Event()
+
+
+class ExpressionServer:
+    """Scores batches of expressions against datasets kept in memory.
+
+    Requests for the same dataset that arrive within coalesce seconds of each
+    other are evaluated as one batch, so they share a single expression DAG
+    and common subexpressions across requests are computed once."""
+
+    def __init__(self, coalesce=COALESCE_SECONDS, memory_budget=BATCH_MEMORY_BYTES):
+        import torch
+        self.torch = torch
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        torch.set_grad_enabled(False)
+        self.ops = torch_fused_ops()
+        self.coalesce = coalesce
+        self.memory_budget = memory_budget
+        self.datasets = {}
+        self.workers = {}
+        self.batches = 0
+        self.requests = 0
+
+    def dataset(self, csv_file):
+        key = os.path.abspath(csv_file)
+        if key not in self.datasets:
+            self.datasets[key] = Dataset(csv_file, self.torch, self.device)
+            self.workers[key] = asyncio.create_task(self.batch_loop(self.datasets[key]))
+        return self.datasets[key]
+
+    async def score(self, csv_file, expressions):
+        trees = [parse(e) for e in expressions]
+        if not trees:
+            return []
+        data = self.dataset(csv_file)
+        # Checked before the request joins a batch, so that it fails alone.
+        missing = referenced_columns(expressions) - data.X.keys()
+        if missing:
+            raise KeyError(f"unknown columns {', '.join(sorted(missing))} in {csv_file}")
+        future = asyncio.get_running_loop().create_future()
+        data.pending.append((trees, future))
+        data.wakeup.set()
+        return await future
+
+    async def batch_loop(self, data):
+        loop = asyncio.get_running_loop()
+        while True:
+            await data.wakeup.wait()
+            await asyncio.sleep(self.coalesce)
+            data.wakeup.clear()
+            batch = []
+            n_trees = 0
+            while data.pending and (not batch or n_trees + len(data.pending[0][0]) <= MAX_COALESCED):
+                trees, future = data.pending.pop(0)
+                batch.append((trees, future))
+                n_trees += len(trees)
+            if data.pending:
+                data.wakeup.set()
+            trees = [tree for request, _ in batch for tree in request]
+            try:
+                mse = await loop.run_in_executor(None, self.evaluate, data, trees)
+            except Exception as exc:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(exc)
+                    continue
+                # Scores the requests one by one, so that the error only
+                # reaches the request that caused it.
+                for request, future in batch:
+                    try:
+                        future.set_result(await loop.run_in_executor(None, self.evaluate, data, request))
+                        self.batches += 1
+                        self.requests += 1
+                    except Exception as exc:
+                        future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            start = 0
+            for request, future in batch:
+                future.set_result(mse[start:start + len(request)])
+                start += len(request)
+
+    def evaluate(self, data, trees):
+        torch = self.torch
+        dag = ExpressionDAG()
+        batch_bytes, cache_bytes = split_budget(self.memory_budget)
+        cache = LRUCache(cache_bytes)
+        roots = [dag.add(tree) for tree in trees]
+        step = max_batch_size(len(data.y), max(depth(t) for t in trees), 8, batch_bytes)
+        errs = []
+        for i in range(0, len(roots), step):
+            preds = torch.stack([dag.evaluate(root, data.X, self.ops, cache) for root in roots[i:i + step]])
+            errs.append(torch.mean((preds - data.y) ** 2, dim=1))
+        return torch.cat(errs).tolist()
+
+    def stats(self):
+        return {
+            "datasets": list(self.datasets),
+            "requests": self.requests,
+            "batches": self.batches
+        }
+
+    async def respond(self, line, writer):
+        response = {"id": None}
+        try:
+            request = json.loads(line)
+            response["id"] = request.get("id")
+            if request.get("stats"):
+                response["stats"] = self.stats()
+            else:
+                response["mse"] = await self.score(request["dataset"], request["expressions"])
+        except Exception as exc:
+            # Any failure, including a line that is not a JSON object, is
+            # answered, so the client never waits for a response forever.
+            response["error"] = f"{type(exc).__name__}: {exc}"
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """One JSON request per line. Requests on a connection are answered as
+        they finish, not in order, so responses carry the request id."""
+        tasks = set()
+        while line := await reader.readline():
+            task = asyncio.create_task(self.respond(line, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(server, unix=None, host="127.0.0.1", port=None):
+    handle = server.handle
+    if unix is not None:
+        listener = await asyncio.start_unix_server(handle, path=unix)
+        address = unix
+    else:
+        listener = await asyncio.start_server(handle, host=host, port=port)
+        host, port = listener.sockets[0].getsockname()[:2]
+        address = f"{host}:{port}"
+    print(f"Serving on {address} (device: {server.device})", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident expression evaluation server")
+    parser.add_argument("--unix", default=None, metavar="PATH",
+                        help=f"listen on a Unix socket (default {SOCKET_PATH} unless --port is given)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="listen on localhost TCP instead")
+    parser.add_argument("--coalesce-ms", type=float, default=COALESCE_SECONDS * 1000,
+                        help="how long to wait for more requests before evaluating a batch")
+    parser.add_argument("--preload", nargs="*", default=[], metavar="CSV",
+                        help="datasets to load before accepting connections")
+    args = parser.parse_args(argv)
+
+    unix = args.unix
+    if unix is None and args.port is None:
+        unix = SOCKET_PATH
+    if unix is not None and os.path.exists(unix):
+        os.unlink(unix)
+
+    async def run():
+        server = ExpressionServer(coalesce=args.coalesce_ms / 1000)
+        start = time.perf_counter()
+        for csv_file in args.preload:
+            server.dataset(csv_file)
+        if args.preload:
+            print(f"Loaded {len(args.preload)} datasets in {time.perf_counter() - start:.2f}s")
+        await serve(server, unix, args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if unix is not None and os.path.exists(unix):
+            os.unlink(unix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import re
+import numpy as np
+
+UNARY_FUNS = ("sinf", "cosf", "tanf", "sqrtf", "expf")
+BINARY_OPS = ("+", "-")
+
+NP_OPS = {
+    "sinf": np.sin,
+    "cosf": np.cos,
+    "tanf": np.tan,
+    "sqrtf": np.sqrt,
+    "expf": np.exp,
+    "+": np.add,
+    "-": np.subtract
+}
+
+# Grammar of random_program, a subset of UNARY_FUNS and BINARY_OPS.
+PROGRAM_FUNS = ("sinf", "cosf", "sqrtf")
+PROGRAM_OPS = ("+", "-")
+
+TOKEN_RE = re.compile(r"\s*(?:_(\w+?)_|([A-Za-z]\w*)|([()+-]))")
+COLUMN_RE = re.compile(r"_(\w+?)_")
+
+# AST nodes are plain tuples so they can be hashed and compared:
+#   ("col", name)
+#   ("un", fun, child)
+#   ("bin", op, left, right)
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise ValueError(f"Unexpected character {expr[pos]!r} at {pos} in {expr!r}")
+        col, name, sym = m.groups()
+        if col is not None:
+            tokens.append(("col", col))
+        elif name is not None:
+            tokens.append(("name", name))
+        else:
+            tokens.append(("sym", sym))
+        pos = m.end()
+    return tokens
+
+
+def parse(expr):
+    """Parses an expression emitted by random_program into a tuple AST."""
+    tokens = tokenize(expr)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def expect(sym):
+        nonlocal pos
+        if peek() != ("sym", sym):
+            raise ValueError(f"Expected {sym!r} at token {pos} in {expr!r}")
+        pos += 1
+
+    def parse_sum():
+        nonlocal pos
+        node = parse_term()
+        while peek()[0] == "sym" and peek()[1] in BINARY_OPS:
+            op = tokens[pos][1]
+            pos += 1
+            node = ("bin", op, node, parse_term())
+        return node
+
+    def parse_term():
+        nonlocal pos
+        kind, value = peek()
+        if kind == "col":
+            pos += 1
+            return ("col", value)
+        if kind == "name":
+            if value not in UNARY_FUNS:
+                raise ValueError(f"Unknown function {value!r} in {expr!r}")
+            pos += 1
+            expect("(")
+            child = parse_sum()
+            expect(")")
+            return ("un", value, child)
+        if (kind, value) == ("sym", "("):
+            pos += 1
+            node = parse_sum()
+            expect(")")
+            return node
+        raise ValueError(f"Unexpected token {value!r} at token {pos} in {expr!r}")
+
+    node = parse_sum()
+    if pos != len(tokens):
+        raise ValueError(f"Trailing input at token {pos} in {expr!r}")
+    return node
+
+
+def compile_numpy(node):
+    """Turns an AST into a closure that evaluates it over a dict of column arrays."""
+    kind = node[0]
+    if kind == "col":
+        name = node[1]
+        return lambda X: X[name]
+    if kind == "un":
+        fun = NP_OPS[node[1]]
+        child = compile_numpy(node[2])
+        return lambda X: fun(child(X))
+    op = NP_OPS[node[1]]
+    left = compile_numpy(node[2])
+    right = compile_numpy(node[3])
+    return lambda X: op(left(X), right(X))
+
+
+def referenced_columns(lines):
+    """Columns that appear as _col_ leaves in any of the expressions, found
+    without parsing them."""
+    columns = set()
+    for line in lines:
+        columns.update(COLUMN_RE.findall(line))
+    return columns
+
+
+def depth(node):
+    kind = node[0]
+    if kind == "col":
+        return 0
+    if kind == "un":
+        return 1 + depth(node[2])
+    return 1 + max(depth(node[2]), depth(node[3]))
+
+
+def to_source(node):
+    """Prints an AST back in the random_program format."""
+    kind = node[0]
+    if kind == "col":
+        return f"_{node[1]}_"
+    if kind == "un":
+        return f"{node[1]}({to_source(node[2])})"
+    return f"({to_source(node[2])}) {node[1]} ({to_source(node[3])})"
+
+
+def canonical(node):
+    """Orders the operands of every + so that expressions that only differ by
+    commutativity share one AST. Only exact IEEE identities are applied."""
+    kind = node[0]
+    if kind == "col":
+        return node
+    if kind == "un":
+        return ("un", node[1], canonical(node[2]))
+    left = canonical(node[2])
+    right = canonical(node[3])
+    if node[1] == "+" and to_source(right) < to_source(left):
+        left, right = right, left
+    return ("bin", node[1], left, right)
+
+
+def random_program(depth, rng, cols):
+    """Gera expressão aleatória com profundidade controlada."""
+    r = rng.randint(0, 100)
+    if depth == 0 or r < 30:
+        c = rng.choice(cols)
+        return f"_{c}_"
+    elif r < 80:
+        c = rng.choice(PROGRAM_FUNS)
+        r = random_program(depth - 1, rng, cols)
+        return f"{c}({r})"
+    else:
+        c = rng.choice(PROGRAM_OPS)
+        r1 = random_program(depth - 1, rng, cols)
+        r2 = random_program(depth - 1, rng, cols)
+        return f"({r1}) {c} ({r2})"
@@ -0,0 +1,103 @@
+import numpy as np
+
+FUSED_NP_OPS = {
+    "sinf": np.sin,
+    "cosf": np.cos,
+    "tanf": np.tan,
+    "sqrtf": np.sqrt,
+    "expf": np.exp,
+    "+": np.add,
+    "-": np.subtract,
+    "copy": lambda x, out: np.copyto(out, x)
+}
+
+
+def torch_fused_ops():
+    import torch
+    return {
+        "sinf": torch.sin,
+        "cosf": torch.cos,
+        "tanf": torch.tan,
+        "sqrtf": torch.sqrt,
+        "expf": torch.exp,
+        "+": torch.add,
+        "-": torch.sub,
+        "copy": lambda x, out: out.copy_(x)
+    }
+
+
+class RegisterPool:
+    """Hands out scratch rows, reusing the ones that are no longer live."""
+
+    def __init__(self):
+        self.free = []
+        self.size = 0
+
+    def take(self):
+        if self.free:
+            return self.free.pop()
+        self.size += 1
+        return self.size - 1
+
+    def give(self, reg):
+        if reg is not None:
+            self.free.append(reg)
+
+
+def emit(node, lines, pool, dest=None):
+    """Emits the statements that compute node. Returns the source of the value
+    and the scratch register that holds it (None for a column or dest)."""
+    kind = node[0]
+    if kind == "col":
+        src = f"X['{node[1]}']"
+        if dest is not None:
+            lines.append(f"    OPS['copy']({src}, out={dest})")
+            return dest, None
+        return src, None
+
+    if kind == "un":
+        arg, reg = emit(node[2], lines, pool)
+        if dest is None and reg is None:
+            reg = pool.take()
+        target = dest if dest is not None else f"scratch[{reg}]"
+        lines.append(f"    OPS['{node[1]}']({arg}, out={target})")
+        if dest is not None:
+            pool.give(reg)
+            return dest, None
+        return target, reg
+
+    left, lreg = emit(node[2], lines, pool)
+    right, rreg = emit(node[3], lines, pool)
+    if dest is not None:
+        target, reg = dest, None
+        pool.give(lreg)
+        pool.give(rreg)
+    elif lreg is not None:
+        target, reg = left, lreg
+        pool.give(rreg)
+    elif rreg is not None:
+        target, reg = right, rreg
+    else:
+        reg = pool.take()
+        target = f"scratch[{reg}]"
+    lines.append(f"    OPS['{node[1]}']({left}, {right}, out={target})")
+    return target, reg
+
+
+def generate_batch_code(trees):
+    """Source of one function that writes every tree of the batch into its
+    row of the preallocated out buffer, with intermediates in scratch."""
+    lines = ["def batch_kernel(X, OPS, scratch, out):"]
+    n_regs = 0
+    for i, tree in enumerate(trees):
+        pool = RegisterPool()
+        emit(tree, lines, pool, dest=f"out[{i}]")
+        n_regs = max(n_regs, pool.size)
+    return "\n".join(lines) + "\n", n_regs
+
+
+def compile_batch(trees):
+    code, n_regs = generate_batch_code(trees)
+    env = {}
+    exec(code, {}, env)
+    return env["batch_kernel"], n_regs
@@ -2,6 +2,12 @@ import numpy as np
 import pandas as pd
 import random as rd
 import os
+import argparse
+from multiprocessing import Pool
+
+from expressions import random_program
+from columnar import columnar_dir, create_columnar
+from cost_model import MODEL_FILE, CostModel, workload
 
 FEATURES = 10
 cols = "abcdefghijkmnopqrstuv"
@@ -21,75 +27,126 @@ test_configs = [
     (200000, 2000, 5, "xlarge_extreme"),
 ]
 
-unary_funs = ["sinf", "cosf", "sqrtf"]
-operators = ["+", "-"]
-
-def random_program(depth=4):
-    """Gera expressão aleatória com profundidade controlada."""
-    r = rd.randint(0, 100)
-    if depth == 0 or r < 30:
-        c = rd.choice(columns)
-        return f"_{c}_"
-    elif r < 80:
-        c = rd.choice(unary_funs)
-        r = random_program(depth - 1)
-        return f"{c}({r})"
-    else:
-        c = rd.choice(operators)
-        r1 = random_program(depth - 1)
-        r2 = random_program(depth - 1)
-        return f"({r1}) {c} ({r2})"
-
-os.makedirs("test_cases", exist_ok=True)
-
-print("=" * 80)
-print("Generating test cases for CPU vs GPU comparison")
-print("=" * 80 + "\n")
-
-for n_rows, n_functions, depth, name in test_configs:
-    print(f"Creating {name}:")
-    print(f"  - Rows: {n_rows:,}")
-    print(f"  - Functions: {n_functions:,}")
-    print(f"  - Depth: {depth}")
-    
-    x = np.random.rand(n_rows, FEATURES)
+production_configs = [
+    (1_000_000, 10_000, 5, "production_tall"),
+    (10_000_000, 100_000, 5, "production_extreme"),
+]
+
+SEED = 42
+CHUNK_ROWS = 1_000_000
+
+def config_seeds(seed, name):
+    """Independent seeds for the features, the noise and the functions of one
+    config. They depend only on the seed and the config name, so the output
+    does not change with the number of workers or the chunk size."""
+    name_key = [ord(ch) for ch in name]
+    return np.random.SeedSequence([seed, *name_key]).spawn(3)
+
+def make_rows(features_rng, noise_rng, n_rows):
+    """n_rows random feature rows and their target, as a DataFrame."""
+    x = features_rng.random((n_rows, FEATURES))
     df = pd.DataFrame(x, columns=columns)
-    df["y"] = np.sin(df["a"].values) + np.cos(df["b"].values) + np.random.rand(n_rows) * 0.001
-    
-    csv_file = f"test_cases/data_{name}.csv"
-    df.to_csv(csv_file, index=False)
-    print(f"  ✓ Created {csv_file}")
-    
-    functions = []
-    for _ in range(n_functions):
-        functions.append(random_program(depth))
-    
-    functions_file = f"test_cases/functions_{name}.txt"
+    df["y"] = np.sin(df["a"].values) + np.cos(df["b"].values) + noise_rng.random(n_rows) * 0.001
+    return df
+
+def generate_config(config, seed=SEED, chunk_rows=CHUNK_ROWS, dtype="float64", out_dir="test_cases"):
+    n_rows, n_functions, depth, name = config
+    features_seed, noise_seed, functions_seed = config_seeds(seed, name)
+    features_rng = np.random.default_rng(features_seed)
+    noise_rng = np.random.default_rng(noise_seed)
+    program_rng = rd.Random(int(functions_seed.generate_state(1)[0]))
+
+    csv_file = f"{out_dir}/data_{name}.csv"
+    columnar = create_columnar(columnar_dir(csv_file), columns + ["y"], n_rows, dtype)
+
+    with open(csv_file, "w") as f:
+        f.write(",".join(columns + ["y"]) + "\n")
+        for start in range(0, n_rows, chunk_rows):
+            stop = min(start + chunk_rows, n_rows)
+            df = make_rows(features_rng, noise_rng, stop - start)
+            df.to_csv(f, index=False, header=False)
+            for c in df.columns:
+                columnar[c][start:stop] = df[c].values
+    for c in columnar:
+        columnar[c].flush()
+
+    functions_file = f"{out_dir}/functions_{name}.txt"
+    total_len = 0
     with open(functions_file, "w") as f:
-        for func in functions:
+        for _ in range(n_functions):
+            func = random_program(depth, program_rng, columns)
+            total_len += len(func)
             f.write(func + "\n")
-    print(f"  ✓ Created {functions_file}")
-    
-    avg_len = sum(len(f) for f in functions) / len(functions)
-    print(f"  ✓ Avg expression length: {avg_len:.1f} chars")
-    print()
 
-print("=" * 80)
-print("Summary of test cases:")
-print("=" * 80)
-print(f"{'Name':<20} {'Rows':<12} {'Functions':<12} {'Complexity':<12} {'GPU Expected'}")
-print("-" * 80)
+    return {
+        "name": name,
+        "rows": n_rows,
+        "functions": n_functions,
+        "depth": depth,
+        "files": [csv_file, columnar_dir(csv_file) + "/", functions_file],
+        "avg_len": total_len / n_functions
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate test cases for CPU vs GPU comparison")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64",
+                        help="storage type of the columnar copy (the CSV is unchanged); a float32 copy "
+                             "is only read in float32, float64 runs parse the CSV")
+    parser.add_argument("--production", action="store_true",
+                        help="also generate the production-scale configs (up to 10M rows, 100k functions)")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="generate only these configs")
+    args = parser.parse_args(argv)
+
+    configs = test_configs + (production_configs if args.production else [])
+    if args.only:
+        configs = [c for c in configs if c[3] in args.only]
+
+    os.makedirs("test_cases", exist_ok=True)
+
+    print("=" * 80)
+    print("Generating test cases for CPU vs GPU comparison")
+    print(f"Seed: {args.seed}, Workers: {args.workers}, Chunk: {args.chunk_rows:,} rows")
+    print("=" * 80 + "\n")
 
-for n_rows, n_functions, depth, name in test_configs:
-    complexity = n_rows * n_functions
-    gpu_wins = "✓ Yes" if complexity > 5_000_000 else "✗ No" if complexity < 1_000_000 else "? Maybe"
-    print(f"{name:<20} {n_rows:<12,} {n_functions:<12,} {complexity:<12,} {gpu_wins}")
+    with Pool(args.workers) as pool:
+        jobs = [pool.apply_async(generate_config, (config, args.seed, args.chunk_rows, args.dtype))
+                for config in configs]
+        for job in jobs:
+            info = job.get()
+            print(f"Created {info['name']}:")
+            print(f"  - Rows: {info['rows']:,}")
+            print(f"  - Functions: {info['functions']:,}")
+            print(f"  - Depth: {info['depth']}")
+            for path in info["files"]:
+                print(f"  ✓ Created {path}")
+            print(f"  ✓ Avg expression length: {info['avg_len']:.1f} chars")
+            print()
 
-print("\n" + "=" * 80)
-print("Test files created in ./test_cases/")
-print("Use these files to benchmark CPU vs GPU performance")
-print("=" * 80)
+    print("=" * 80)
+    print("Summary of test cases:")
+    print("=" * 80)
+    model = CostModel.load() if os.path.exists(MODEL_FILE) else None
+    expected = "Fastest engine" if model else "GPU Expected"
+    print(f"{'Name':<20} {'Rows':<12} {'Functions':<12} {'Complexity':<12} {expected}")
+    print("-" * 80)
 
-        
+    for n_rows, n_functions, depth, name in configs:
+        complexity = n_rows * n_functions
+        if model:
+            engine, predicted = model.choose(*workload(f"test_cases/data_{name}.csv",
+                                                       f"test_cases/functions_{name}.txt"))
+            gpu_wins = f"{engine} (~{predicted:.3f}s)"
+        else:
+            gpu_wins = "✓ Yes" if complexity > 5_000_000 else "✗ No" if complexity < 1_000_000 else "? Maybe"
+        print(f"{name:<20} {n_rows:<12,} {n_functions:<12,} {complexity:<12,} {gpu_wins}")
 
+    print("\n" + "=" * 80)
+    print("Test files created in ./test_cases/")
+    print("Use these files to benchmark CPU vs GPU performance")
+    print("=" * 80)
 
+if __name__ == "__main__":
+    main()
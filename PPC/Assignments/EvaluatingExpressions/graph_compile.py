@@ -0,0 +1,85 @@
+import time
+import warnings
+
+from expressions import referenced_columns, to_source
+
+GRAPH_MODES = ("trace", "compile")
+GRAPH_BATCH = 64
+
+TORCH_FUNS = {
+    "sinf": "torch.sin",
+    "cosf": "torch.cos",
+    "tanf": "torch.tan",
+    "sqrtf": "torch.sqrt",
+    "expf": "torch.exp"
+}
+
+# Compiled graphs by batch signature, under the scope they were built for.
+# Only one scope is kept at a time.
+_graphs = {}
+
+
+def torch_source(node):
+    kind = node[0]
+    if kind == "col":
+        return f"c_{node[1]}"
+    if kind == "un":
+        return f"{TORCH_FUNS[node[1]]}({torch_source(node[2])})"
+    return f"({torch_source(node[2])} {node[1]} {torch_source(node[3])})"
+
+
+def generate_graph_code(trees, columns):
+    """Source of a pure function from the column tensors and y to the MSE of
+    every tree of the batch, written so it can be traced or compiled as a
+    single graph."""
+    args = ", ".join(["y"] + [f"c_{c}" for c in columns])
+    preds = ",\n        ".join(torch_source(t) for t in trees)
+    return (f"def batch_graph({args}):\n"
+            f"    preds = torch.stack([\n        {preds}])\n"
+            f"    return ((preds - y) ** 2).mean(1)\n")
+
+
+def signature(trees, mode, y):
+    """Identifies a compiled graph: the expressions of the batch, the mode and
+    the dtype and device it was specialized for."""
+    return (mode, str(y.dtype), str(y.device), tuple(to_source(t) for t in trees))
+
+
+def build_graph(trees, columns, mode, X, y):
+    import torch
+    env = {}
+    exec(generate_graph_code(trees, columns), {"torch": torch, "__name__": __name__}, env)
+    fn = env["batch_graph"]
+    args = (y, *[X[c] for c in columns])
+    if mode == "trace":
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            graph = torch.jit.trace(fn, args)
+    else:
+        graph = torch.compile(fn, dynamic=False)
+    # The profiling executor and torch.compile both optimize on the first
+    # calls, so they are made here and not during evaluation.
+    graph(*args)
+    graph(*args)
+    return graph
+
+
+def graph_kernel(trees, mode, X, y, scope=None):
+    """The compiled graph of a batch, built on the first request for its
+    signature and cached afterwards. Returns the graph, the columns it takes
+    (after y), the seconds spent building it (0 if it was cached) and
+    whether it was cached. The cache holds the graphs of one scope, such as
+    a functions file: a request from another scope drops them first."""
+    columns = sorted(referenced_columns(to_source(t) for t in trees))
+    if scope not in _graphs:
+        _graphs.clear()
+        _graphs[scope] = {}
+    graphs = _graphs[scope]
+    key = signature(trees, mode, y)
+    if key in graphs:
+        return graphs[key], columns, 0.0, True
+    start = time.perf_counter_ns()
+    graph = build_graph(trees, columns, mode, X, y)
+    seconds = (time.perf_counter_ns() - start) / 1e9
+    graphs[key] = graph
+    return graph, columns, seconds, False
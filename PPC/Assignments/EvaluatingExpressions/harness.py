@@ -0,0 +1,144 @@
+import json
+import math
+import multiprocessing as mp
+import os
+import platform
+import statistics
+import sys
+
+import numpy as np
+
+PERCENTILES = ["0.0", "50.0", "90.0", "95.0", "99.0", "99.9", "99.99", "99.999", "99.9999", "100.0"]
+CONFIDENCE = 0.999
+
+
+def betacf(a, b, x):
+    """Continued fraction of the incomplete beta function (Lentz's method)."""
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for aa in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                   -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + aa / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0 or x >= 1:
+        return 0.0 if x <= 0 else 1.0
+    bt = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                  + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1) / (a + b + 2):
+        return bt * betacf(a, b, x) / a
+    return 1.0 - bt * betacf(b, a, 1 - x) / b
+
+
+def t_cdf(x, df):
+    tail = 0.5 * betainc(df / 2, 0.5, df / (df + x * x))
+    return 1 - tail if x > 0 else tail
+
+
+def t_quantile(p, df):
+    lo, hi = 0.0, 1e7
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if t_cdf(mid, df) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def summarize(samples):
+    """Score, error and percentiles of a list of samples, as JMH computes them:
+    the error is the half-width of the 99.9% Student t confidence interval."""
+    mean = statistics.fmean(samples)
+    if len(samples) > 1:
+        sd = statistics.stdev(samples)
+        error = t_quantile(1 - (1 - CONFIDENCE) / 2, len(samples) - 1) * sd / math.sqrt(len(samples))
+    else:
+        error = float("nan")
+    percentiles = np.percentile(samples, [float(p) for p in PERCENTILES])
+    return {
+        "score": mean,
+        "scoreError": error,
+        "scoreConfidence": [mean - error, mean + error],
+        "scorePercentiles": dict(zip(PERCENTILES, percentiles.tolist())),
+        "scoreUnit": "ms/op"
+    }
+
+
+def run_fork(fn, args, kwargs, warmup, iterations):
+    """Warmup then measurement iterations of fn, which returns its own elapsed
+    seconds first. Returns the measured times in ms and the last result."""
+    for _ in range(warmup):
+        fn(*args, **kwargs)
+    samples = []
+    result = None
+    for _ in range(iterations):
+        result = fn(*args, **kwargs)
+        samples.append(result[0] * 1000)
+    return samples, result
+
+
+def fork_main(conn, fn, args, kwargs, warmup, iterations):
+    """Entry point of a forked benchmark process. Not a Pool worker, so the
+    benchmark itself may still start its own worker processes."""
+    conn.send(run_fork(fn, args, kwargs, warmup, iterations))
+    conn.close()
+
+
+def measure(fn, args=(), kwargs=None, params=None, warmup=2, iterations=5, forks=0):
+    """Benchmarks fn and returns a JMH-style result entry together with the
+    value returned by its last call. With forks > 0 every fork runs in a fresh
+    interpreter, otherwise everything runs in this process."""
+    kwargs = kwargs or {}
+    raw = []
+    result = None
+    if forks == 0:
+        samples, result = run_fork(fn, args, kwargs, warmup, iterations)
+        raw.append(samples)
+    else:
+        ctx = mp.get_context("spawn")
+        for _ in range(forks):
+            recv, send = ctx.Pipe(duplex=False)
+            fork = ctx.Process(target=fork_main, args=(send, fn, args, kwargs, warmup, iterations))
+            fork.start()
+            samples, result = recv.recv()
+            fork.join()
+            raw.append(samples)
+
+    module = fn.__module__
+    if module == "__main__":
+        module = os.path.splitext(os.path.basename(sys.modules["__main__"].__file__))[0]
+    metric = summarize([s for fork in raw for s in fork])
+    metric["rawData"] = raw
+    entry = {
+        "benchmark": f"{module}.{fn.__name__}",
+        "mode": "avgt",
+        "threads": 1,
+        "forks": forks,
+        "jvm": sys.executable,
+        "jdkVersion": platform.python_version(),
+        "vmName": platform.python_implementation(),
+        "warmupIterations": warmup,
+        "measurementIterations": iterations,
+        "params": {k: str(v) for k, v in (params or {}).items()},
+        "primaryMetric": metric,
+        "secondaryMetrics": {}
+    }
+    return entry, result
+
+
+def write_results(entries, path):
+    with open(path, "w") as f:
+        json.dump(entries, f, indent=4)
@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from expressions import NP_OPS, parse, referenced_columns
+from expression_dag import CSE_CACHE_BYTES, ExpressionDAG, LRUCache
+from blocked_eval import blocked_sse
+from columnar import columnar_dir, append_columnar, MANIFEST, load_columns
+from score_cache import CACHE_DIR, dataset_hash
+from leaderboard import stream_top_k
+
+BLOCK_ROWS = 4096
+
+
+class IncrementalScorer:
+    """Per-expression sufficient statistics (sum of squared errors and row
+    count) of one function set over a dataset that only grows by appending.
+
+    Rows are summed in fixed blocks of BLOCK_ROWS aligned at row 0, and the
+    state keeps the sum over the complete blocks seen so far. An update only
+    evaluates the rows after the last complete block, so the new rows plus
+    at most one partial block. Since a full recompute adds up the very same
+    block sums in the same order, both give bit-identical MSEs.
+
+    The state is saved in the score cache directory together with a hash of
+    the rows it covers; if those rows changed, the next update starts over."""
+
+    def __init__(self, csv_file, functions_file, directory=CACHE_DIR):
+        self.csv_file = csv_file
+        self.funs = [line.strip() for line in open(functions_file).readlines()]
+        h = hashlib.blake2b(digest_size=16)
+        h.update(os.path.abspath(csv_file).encode())
+        h.update("\n".join(self.funs).encode())
+        self.path = os.path.join(directory, f"incremental_{h.hexdigest()}.npz")
+        self.trees = [parse(line) for line in self.funs]
+
+    def load_state(self, X, n_rows):
+        """SSE and row count of the complete blocks already summed, or an empty
+        state if there is none or the rows it covers are not a prefix of X."""
+        empty = np.zeros(len(self.funs)), 0
+        if not os.path.exists(self.path):
+            return empty
+        state = np.load(self.path)
+        rows = int(state["rows"])
+        if rows > n_rows or dataset_hash({c: v[:rows] for c, v in X.items()}) != str(state["prefix"]):
+            return empty
+        return state["sse"], rows
+
+    def save_state(self, X, sse, rows):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        prefix = dataset_hash({c: v[:rows] for c, v in X.items()})
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, sse=sse, rows=rows, prefix=prefix)
+        os.replace(tmp, self.path)
+
+    def update(self, full=False):
+        """MSE of every expression over all current rows, and the number of
+        rows evaluated to get it. With full=True the saved state is ignored
+        (and left untouched)."""
+        X = load_columns(self.csv_file, columns=referenced_columns(self.funs) | {"y"})
+        n_rows = len(X["y"])
+        if full:
+            sse, done = np.zeros(len(self.funs)), 0
+        else:
+            sse, done = self.load_state(X, n_rows)
+
+        features = {c: v for c, v in X.items() if c != "y"}
+        y = X["y"]
+        dag = ExpressionDAG()
+        cache = LRUCache(CSE_CACHE_BYTES)
+        kernels = [partial(dag.evaluate, dag.add(t), ops=NP_OPS, cache=cache) for t in self.trees]
+
+        def block(start, stop):
+            Xb = {c: v[start:stop] for c, v in features.items()}
+            return blocked_sse(kernels, Xb, y[start:stop], stop - start, on_block=cache.clear)
+
+        evaluated = n_rows - done
+        complete = n_rows - n_rows % BLOCK_ROWS
+        for start in range(done, complete, BLOCK_ROWS):
+            sse = sse + block(start, start + BLOCK_ROWS)
+        total = sse + block(complete, n_rows) if complete < n_rows else sse
+
+        if not full:
+            self.save_state(X, sse, complete)
+        return total / n_rows, evaluated
+
+    def leaderboard(self, mse, k=1):
+        return stream_top_k(zip(mse.tolist(), self.funs), k)
+
+
+def append_rows(csv_file, df):
+    """Appends the rows of a DataFrame to a test case CSV and to its columnar
+    copy, if there is one."""
+    with open(csv_file, "a") as f:
+        df.to_csv(f, index=False, header=False)
+    directory = columnar_dir(csv_file)
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        append_columnar(directory, {c: df[c].values for c in df.columns})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Append rows to a test case and re-score it incrementally (modifies the test case)")
+    parser.add_argument("test_case", help="e.g. medium_complex")
+    parser.add_argument("--append", type=float, default=0.01, help="rows to append, as a fraction of the rows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from generate_inputs import make_rows
+
+    csv_file = f"test_cases/data_{args.test_case}.csv"
+    functions_file = f"test_cases/functions_{args.test_case}.txt"
+    scorer = IncrementalScorer(csv_file, functions_file)
+
+    start = time.perf_counter_ns()
+    _, evaluated = scorer.update()
+    print(f"Initial scoring: {evaluated:,} rows in {(time.perf_counter_ns() - start) / 1e9:.4f}s")
+
+    n_rows = len(load_columns(csv_file, columns={"y"})["y"])
+    n_new = max(1, int(n_rows * args.append))
+    rng = np.random.default_rng(args.seed)
+    append_rows(csv_file, make_rows(rng, rng, n_new))
+    print(f"Appended {n_new:,} rows to {n_rows:,}")
+
+    start = time.perf_counter_ns()
+    mse, evaluated = scorer.update()
+    incremental = (time.perf_counter_ns() - start) / 1e9
+    print(f"Incremental: {evaluated:,} rows in {incremental:.4f}s")
+
+    start = time.perf_counter_ns()
+    full_mse, evaluated = scorer.update(full=True)
+    full = (time.perf_counter_ns() - start) / 1e9
+    print(f"Full:        {evaluated:,} rows in {full:.4f}s ({full / incremental:.1f}x slower)")
+    print(f"Identical to the full recompute: {np.array_equal(mse, full_mse, equal_nan=True)}")
+
+    for rank, (err, expr) in enumerate(scorer.leaderboard(mse, args.top_k), 1):
+        print(f"  {rank:>3}. {err:.6e}  {expr}")
+
+
+if __name__ == "__main__":
+    main()
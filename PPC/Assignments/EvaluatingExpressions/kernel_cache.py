@@ -0,0 +1,129 @@
+import glob
+import hashlib
+import marshal
+import os
+import sys
+import types
+
+from expressions import parse
+from fused_codegen import generate_batch_code
+
+CACHE_DIR = "kernel_cache"
+PYTHON_VERSION = sys.implementation.cache_tag
+
+# Function sets whose ASTs are kept, the most recently used ones.
+MAX_AST_SETS = 16
+
+
+def kernel_key(expr, backend):
+    """Hash of an expression (or generated source), the backend it was
+    compiled for and the Python version, since code objects and the marshal
+    format change between versions."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{backend}\0{PYTHON_VERSION}\0{expr}".encode())
+    return h.digest()
+
+
+def function_code(source, name):
+    """Code object of the function called name defined in source."""
+    module = compile(source, f"<{name}>", "exec")
+    return next(c for c in module.co_consts if isinstance(c, types.CodeType) and c.co_name == name)
+
+
+class KernelCache:
+    """Marshalled compile results of one backend, in a single file per backend
+    and Python version. Values are code objects or plain data (ASTs made of
+    tuples and strings), so a warm start neither parses nor compiles."""
+
+    def __init__(self, backend, directory=CACHE_DIR):
+        self.backend = backend
+        self.path = os.path.join(directory, f"{backend}-{PYTHON_VERSION}.marshal")
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                try:
+                    self.entries = marshal.load(f)
+                except (EOFError, ValueError, TypeError):
+                    self.entries = {}
+
+    def get(self, expr):
+        value = self.entries.get(kernel_key(expr, self.backend))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, expr, value):
+        self.entries[kernel_key(expr, self.backend)] = value
+        self.dirty = True
+
+    def function(self, source, name, globals_=None):
+        """The function called name defined in source, compiled only if its
+        code object is not cached yet."""
+        code = self.get(source)
+        if code is None:
+            code = function_code(source, name)
+            self.put(source, code)
+        return types.FunctionType(code, globals_ if globals_ is not None else {})
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            marshal.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def parse_all(lines, directory=CACHE_DIR):
+    """ASTs of the expressions, parsed only if this set of lines is not cached
+    yet. Every set (a functions file) is one entry in a file of its own, so
+    a warm start reads just its trees; only the MAX_AST_SETS most recently
+    used sets are kept."""
+    source = "\n".join(lines)
+    cache = KernelCache(f"ast-{kernel_key(source, 'ast').hex()}", directory)
+    trees = cache.get(source)
+    if trees is None:
+        trees = [parse(line) for line in lines]
+        cache.put(source, trees)
+        cache.save()
+        prune(directory, "ast-*", MAX_AST_SETS)
+    else:
+        os.utime(cache.path)
+    return trees
+
+
+def prune(directory, pattern, keep):
+    """Removes all but the keep most recently used cache files matching
+    pattern."""
+    paths = glob.glob(os.path.join(directory, f"{pattern}-{PYTHON_VERSION}.marshal"))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def compile_batches(lines, trees, size, directory=CACHE_DIR):
+    """compile_batch() of every size consecutive trees, keyed by the source
+    lines of the batch, so cached batches are neither generated nor compiled."""
+    cache = KernelCache("fused", directory)
+    batches = []
+    for i in range(0, len(trees), size):
+        key = "\n".join(lines[i:i + size])
+        entry = cache.get(key)
+        if entry is None:
+            source, n_regs = generate_batch_code(trees[i:i + size])
+            entry = function_code(source, "batch_kernel"), n_regs
+            cache.put(key, entry)
+        code, n_regs = entry
+        batches.append((types.FunctionType(code, {}), n_regs))
+    cache.save()
+    return batches
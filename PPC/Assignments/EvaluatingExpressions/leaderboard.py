@@ -0,0 +1,45 @@
+import heapq
+import math
+
+
+def nan_last(item):
+    """Sort key of a (score, line) pair that ranks NaN scores last. Equal
+    scores keep their order, so the earlier expression wins, as in DeviceTopK."""
+    score, line = item
+    return math.inf if math.isnan(score) else score
+
+
+def stream_top_k(pairs, k):
+    """The k smallest (score, line) pairs of a stream, without materializing it.
+    NaN scores rank last."""
+    return heapq.nsmallest(k, pairs, key=nan_last)
+
+
+class DeviceTopK:
+    """Running top-k of the lowest errors, kept in tensors on the device so
+    merging a batch is a fixed number of tensor ops with no host sync."""
+
+    def __init__(self, k, dtype, device):
+        import torch
+        self.torch = torch
+        self.k = k
+        self.values = torch.full((k,), math.inf, dtype=dtype, device=device)
+        self.indices = torch.full((k,), -1, dtype=torch.long, device=device)
+
+    def update(self, errs, offset):
+        """Ranks by error, with NaN errors after every number and the empty
+        slots (index -1) last; ties go to the earlier expression."""
+        torch = self.torch
+        ids = torch.arange(offset, offset + len(errs), device=errs.device)
+        values = torch.cat([self.values, errs])
+        indices = torch.cat([self.indices, ids])
+        rank = torch.isnan(values).long() + 2 * (indices < 0)
+        key = torch.nan_to_num(values, nan=math.inf, posinf=math.inf, neginf=-math.inf)
+        pos = torch.argsort(rank, stable=True)
+        pos = pos[torch.argsort(key[pos], stable=True)][:self.k]
+        self.values = values[pos]
+        self.indices = indices[pos]
+
+    def result(self, funs):
+        """(score, line) pairs, best first. Reads back from the device once."""
+        return [(v, funs[i]) for v, i in zip(self.values.tolist(), self.indices.tolist()) if i >= 0]
@@ -0,0 +1,96 @@
+import numpy as np
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+
+from expressions import NP_OPS, parse, depth
+from expression_dag import ExpressionDAG, LRUCache
+from blocked_eval import choose_block_rows, blocked_sse
+from leaderboard import nan_last
+
+WORKER_CACHE_BYTES = 128 * 1024 ** 2
+
+_worker_shm = None
+_worker_X = None
+_worker_kernels = None
+_worker_cache = None
+_worker_depth = 0
+
+
+class SharedColumns:
+    """Copies the data columns once into a shared memory block laid out as a
+    (n_columns, n_rows) matrix that every worker maps without copying."""
+
+    def __init__(self, X, dtype=np.float64):
+        self.columns = list(X)
+        self.shape = (len(self.columns), len(X[self.columns[0]]))
+        self.dtype = np.dtype(dtype)
+        size = max(1, self.shape[0] * self.shape[1] * self.dtype.itemsize)
+        self.shm = SharedMemory(create=True, size=size)
+        data = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        for i, c in enumerate(self.columns):
+            data[i] = X[c]
+
+    def init_args(self):
+        return self.shm.name, self.shape, self.dtype.str, self.columns
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_columns(shm_name, shape, dtype, columns):
+    """Pool initializer: maps the shared columns into this worker."""
+    global _worker_shm, _worker_X
+    _worker_shm = SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_worker_shm.buf)
+    _worker_X = {c: data[i] for i, c in enumerate(columns)}
+
+
+def attach_rows(shm_name, shape, dtype, columns, lines):
+    """Pool initializer for row sharding: maps the shared columns and compiles
+    the whole function set once in this worker."""
+    global _worker_kernels, _worker_cache, _worker_depth
+    attach_columns(shm_name, shape, dtype, columns)
+    trees = [parse(line) for line in lines]
+    dag = ExpressionDAG()
+    _worker_cache = LRUCache(WORKER_CACHE_BYTES)
+    _worker_kernels = [partial(dag.evaluate, dag.add(t), ops=NP_OPS, cache=_worker_cache)
+                       for t in trees]
+    _worker_depth = max(depth(t) for t in trees)
+
+
+def rows_sse(bounds):
+    """Partial sum of squared errors of every expression over rows [start, stop)."""
+    start, stop = bounds
+    X = {c: v[start:stop] for c, v in _worker_X.items()}
+    y = X.pop("y")
+    block_rows = choose_block_rows(len(X), _worker_depth)
+    return blocked_sse(_worker_kernels, X, y, block_rows, on_block=_worker_cache.clear)
+
+
+def score_shard(lines):
+    """Best (mse, line) of a shard of expressions, evaluated on the shared columns."""
+    X = _worker_X
+    y = X["y"]
+    dag = ExpressionDAG()
+    cache = LRUCache(WORKER_CACHE_BYTES)
+    kernels = [partial(dag.evaluate, dag.add(parse(line)), ops=NP_OPS, cache=cache)
+               for line in lines]
+    return min([(np.square(np.subtract(kernel(X), y)).mean(), line)
+                for kernel, line in zip(kernels, lines)], key=nan_last)
+
+
+def shard(items, n_shards):
+    size = -(-len(items) // n_shards)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def row_ranges(n_rows, n_shards):
+    size = -(-n_rows // n_shards)
+    return [(i, min(i + size, n_rows)) for i in range(0, n_rows, size)]
@@ -0,0 +1,32 @@
+import numpy as np
+
+from columnar import load_columns
+from expressions import parse, compile_numpy, referenced_columns
+
+PRECISIONS = {
+    "float64": np.float64,
+    "float32": np.float32
+}
+
+
+def accuracy_report(engine, csv_file, functions_file, **kwargs):
+    """Runs engine in float64 and in float32 and compares the results.
+
+    The float32 winner is rescored in float64, so regret is how much worse
+    (in float64 MSE) the expression chosen in float32 is than the true best."""
+    _, mse64, expr64 = engine(csv_file, functions_file, precision="float64", **kwargs)[:3]
+    _, mse32, expr32 = engine(csv_file, functions_file, precision="float32", **kwargs)[:3]
+
+    X = load_columns(csv_file, np.float64, referenced_columns([expr32]) | {"y"})
+    pred = compile_numpy(parse(expr32))(X)
+    rescored = float(np.square(np.subtract(pred, X["y"])).mean())
+
+    return {
+        "same_best": expr32 == expr64,
+        "best_float64": expr64,
+        "best_float32": expr32,
+        "mse_float64": float(mse64),
+        "mse_float32": float(mse32),
+        "mse_rel_error": abs(float(mse32) - float(mse64)) / abs(float(mse64)),
+        "regret": rescored - float(mse64)
+    }
@@ -0,0 +1,146 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from stack_machine import NOP, PUSH, OPCODES
+
+
+def count_ops(trees, n_rows=1):
+    """Operations per opcode ("col", "sinf", "+", ...) a tree-walking evaluator
+    performs over n_rows rows, with no sharing between trees."""
+    counter = Counter()
+    stack = list(trees)
+    while stack:
+        node = stack.pop()
+        if node[0] == "col":
+            counter["col"] += n_rows
+        else:
+            counter[node[1]] += n_rows
+            stack.extend(node[2:])
+    return counter
+
+
+def count_dag_ops(dag, n_rows=1):
+    """Operations per opcode when every distinct subtree of the DAG is
+    computed once, which is what the evaluator does if its cache never evicts."""
+    counter = Counter()
+    for node in dag.nodes:
+        counter["col" if node[0] == "col" else node[1]] += n_rows
+    return counter
+
+
+def count_stack_ops(code, n_rows=1):
+    """Instructions per opcode in assembled stack-machine code, NOPs excluded."""
+    names = {op: name for name, op in OPCODES.items()}
+    names[PUSH] = "push"
+    ops, counts = np.unique(code[code != NOP], return_counts=True)
+    return Counter({names[int(op)]: int(n) * n_rows for op, n in zip(ops, counts)})
+
+
+class Profiler:
+    """Records phases as Chrome trace "complete" events and keeps operation
+    counters per opcode. Phases nest, so a batch shows up inside the phase
+    that runs it."""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.counters = {}
+        self.pid = os.getpid()
+
+    def now_us(self):
+        return (time.perf_counter_ns() - self.origin) / 1000
+
+    @contextmanager
+    def phase(self, name, **args):
+        start = self.now_us()
+        try:
+            yield
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": start,
+                "dur": self.now_us() - start,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args
+            })
+
+    def count(self, counter, counts):
+        """Adds counts (a mapping opcode -> n) to the named counter."""
+        total = self.counters.setdefault(counter, Counter())
+        total.update(counts)
+
+    def totals(self):
+        """Total time per phase name in seconds, in order of first appearance."""
+        totals = {}
+        for event in sorted(self.events, key=lambda e: e["ts"]):
+            totals[event["name"]] = totals.get(event["name"], 0) + event["dur"] / 1e6
+        return totals
+
+    def trace(self):
+        events = list(self.events)
+        end = self.now_us()
+        for name, counts in self.counters.items():
+            events.append({
+                "name": name,
+                "ph": "C",
+                "ts": end,
+                "pid": self.pid,
+                "args": dict(counts)
+            })
+        events.append({
+            "name": "process_name",
+            "ph": "M",
+            "pid": self.pid,
+            "args": {"name": self.name}
+        })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path):
+        """Chrome trace-event JSON, viewable in chrome://tracing or Perfetto."""
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+class NullProfiler:
+    """Stands in for a Profiler when an engine runs without one."""
+
+    def phase(self, name, **args):
+        return nullcontext()
+
+    def count(self, counter, counts):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profile_run(fn, args=(), kwargs=None, name=None, trace_path=None, cprofile_path=None):
+    """Runs fn once with a Profiler passed as its profiler argument. Writes the
+    Chrome trace to trace_path and, with cprofile_path, the cProfile stats of
+    the same run. Returns the profiler and fn's result."""
+    profiler = Profiler(name or fn.__name__)
+    cprof = cProfile.Profile() if cprofile_path else None
+    with profiler.phase("total"):
+        if cprof is not None:
+            cprof.enable()
+        try:
+            result = fn(*args, **(kwargs or {}), profiler=profiler)
+        finally:
+            if cprof is not None:
+                cprof.disable()
+    if trace_path:
+        profiler.write_trace(trace_path)
+    if cprof is not None:
+        cprof.dump_stats(cprofile_path)
+    return profiler, result
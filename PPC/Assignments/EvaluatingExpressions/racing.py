@@ -0,0 +1,71 @@
+import numpy as np
+
+FIRST_SAMPLE = 1024
+GROWTH = 4
+Z = 5.0
+
+
+def squared_errors(kernel, X, y):
+    e = np.subtract(kernel(X), y)
+    return np.square(e, out=e)
+
+
+def race(kernels, X, y, first=FIRST_SAMPLE, growth=GROWTH, z=Z, seed=0, on_slice=None):
+    """Successive-halving search for the kernel with the lowest MSE.
+
+    Rows are visited in a shuffled order on growing prefixes. After every
+    stage the current leader is scored on all rows, and a candidate is
+    dropped when its lower bound is above the best exact MSE so far. The
+    bound is the larger of the confidence bound mean - z * stderr and the
+    exact bound partial_sse / n_rows (squared errors are never negative).
+    Survivors of the last stage have seen every row, so all returned MSEs
+    are exact.
+
+    Returns a dict of exact MSEs by kernel index and the number of
+    row evaluations done."""
+    n = len(y)
+    perm = np.random.default_rng(seed).permutation(n)
+    Xp = {c: v[perm] for c, v in X.items()}
+    yp = y[perm]
+
+    def rows(start, stop):
+        if on_slice is not None:
+            on_slice()
+        return {c: v[start:stop] for c, v in Xp.items()}, yp[start:stop]
+
+    alive = np.arange(len(kernels))
+    sse = np.zeros(len(kernels))
+    sse2 = np.zeros(len(kernels))
+    exact = {}
+    evaluated = 0
+    m = 0
+
+    while alive.size and m < n:
+        stop = min(n, max(first, m * growth))
+        Xs, ys = rows(m, stop)
+        for i in alive:
+            e = squared_errors(kernels[i], Xs, ys)
+            sse[i] += e.sum()
+            sse2[i] += np.dot(e, e)
+        evaluated += alive.size * (stop - m)
+        m = stop
+        if m == n:
+            break
+
+        mean = sse[alive] / m
+        mean[np.isnan(mean)] = np.inf
+        leader = alive[np.argmin(mean)]
+        Xr, yr = rows(m, n)
+        exact[leader] = (sse[leader] + squared_errors(kernels[leader], Xr, yr).sum()) / n
+        evaluated += n - m
+        best = min(np.inf if np.isnan(v) else v for v in exact.values())
+
+        with np.errstate(invalid="ignore"):
+            stderr = np.sqrt(np.maximum(sse2[alive] / m - mean ** 2, 0) / m)
+            bound = np.maximum(mean - z * stderr, sse[alive] / n)
+            keep = (bound <= best) & (alive != leader)
+        alive = alive[keep]
+
+    for i in alive:
+        exact[i] = sse[i] / n
+    return exact, evaluated
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = "score_cache"
+
+
+def dataset_hash(X):
+    """Content hash of a dict of column arrays, independent of the file format."""
+    h = hashlib.blake2b(digest_size=16)
+    for c in sorted(X):
+        h.update(c.encode())
+        h.update(np.ascontiguousarray(X[c]).tobytes())
+    return h.hexdigest()
+
+
+class ScoreCache:
+    """MSEs of canonical expressions for one dataset, kept in a JSON file
+    named after the dataset hash."""
+
+    def __init__(self, dataset_key, directory=CACHE_DIR):
+        self.path = os.path.join(directory, f"{dataset_key}.json")
+        self.scores = {}
+        self.dirty = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.scores = json.load(f)
+
+    def get(self, expr):
+        return self.scores.get(expr)
+
+    def put(self, expr, mse):
+        self.scores[expr] = float(mse)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.scores, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
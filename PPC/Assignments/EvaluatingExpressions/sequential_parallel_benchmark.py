@@ -1,45 +1,211 @@
 import numpy as np
-import pandas as pd
-import torch
 import time
 import os
 import glob
+import fnmatch
+import argparse
+from functools import partial
+from multiprocessing import Pool
+
+from expressions import NP_OPS, UNARY_FUNS, compile_numpy, depth, canonical, to_source, referenced_columns
+from expression_dag import CSE_CACHE_BYTES, ExpressionDAG, LRUCache
+from blocked_eval import choose_block_rows, blocked_sse
+from stack_machine import assemble, evaluate_mse
+from fused_codegen import FUSED_NP_OPS, torch_fused_ops
+from racing import race
+from columnar import load_columns
+from score_cache import ScoreCache, dataset_hash
+from harness import measure, write_results
+from precision import PRECISIONS, accuracy_report
+from leaderboard import DeviceTopK, nan_last, stream_top_k
+from batch_sizing import BATCH_MEMORY_BYTES, AdaptiveBatcher, max_batch_size, split_budget
+from profiler import NULL_PROFILER, count_ops, count_dag_ops, count_stack_ops, profile_run
+from cost_model import MODEL_FILE, CostModel, calibrate, workload
+from shape_buckets import bucketize, bucket_mse
+from graph_compile import GRAPH_MODES, GRAPH_BATCH, graph_kernel
+from kernel_cache import KernelCache, parse_all, compile_batches
+from multiprocess_eval import (SharedColumns, attach_columns, attach_rows, score_shard,
+                               rows_sse, shard, row_ranges)
 
 TASK_BATCH = 32
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-torch.set_grad_enabled(False)
-
-OPS = {
-    "sinf": torch.sin,
-    "cosf": torch.cos,
-    "tanf": torch.tan,
-    "sqrtf": torch.sqrt,
-    "expf": torch.exp
-}
-
-def benchmark_sequential(csv_file, functions_file):
-    df = pd.read_csv(csv_file)
-    funs = [line.strip() for line in open(functions_file).readlines()]
+
+def torch_backend():
+    """torch, and the device the torch engines run on. torch is imported here,
+    on the first call of a torch engine, so the NumPy engines never pay for
+    importing it."""
+    import torch
+    torch.set_grad_enabled(False)
+    return torch, torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def benchmark_sequential(csv_file, functions_file, cse=True, precision="float64", top_k=1,
+                         profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        X = load_columns(csv_file, PRECISIONS[precision], columns=referenced_columns(funs) | {"y"})
+    
+    b = X["y"]
+    
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    with profiler.phase("compile", cse=cse):
+        if cse:
+            dag = ExpressionDAG()
+            cache = LRUCache(CSE_CACHE_BYTES)
+            kernels = [partial(dag.evaluate, dag.add(tree), ops=NP_OPS, cache=cache)
+                       for tree in trees]
+        else:
+            kernels = [compile_numpy(tree) for tree in trees]
+    profiler.count("ops", count_dag_ops(dag, len(b)) if cse else count_ops(trees, len(b)))
     
-    def score(line):
-        for u in ["sinf", "cosf", "tanf", "sqrtf", "expf"]:
-            line = line.replace(u, f"np.{u[:-1]}")
-        for c in df.columns:
-            line = line.replace(f"_{c}_", f"(df[\"{c}\"].values)")
-        a = eval(line)
-        b = df["y"]
+    def score(kernel):
+        a = kernel(X)
         e = np.square(np.subtract(a, b)).mean()
         return e
     
-    start = time.time()
-    r = min([(score(line), line) for line in funs])
-    elapsed = time.time() - start
+    start = time.perf_counter_ns()
+    with profiler.phase("evaluate"):
+        board = stream_top_k(((score(kernel), line) for kernel, line in zip(kernels, funs)), top_k)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, board[0][0], board[0][1], board
+
+def benchmark_cached(csv_file, functions_file):
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    y = X["y"]
+    
+    trees = {}
+    canon = []
+    for tree in parse_all(funs):
+        tree = canonical(tree)
+        expr = to_source(tree)
+        trees.setdefault(expr, tree)
+        canon.append(expr)
+    
+    start = time.perf_counter_ns()
+    
+    cache = ScoreCache(dataset_hash(X))
+    misses = [e for e in trees if cache.get(e) is None]
+    
+    dag = ExpressionDAG()
+    lru = LRUCache(CSE_CACHE_BYTES)
+    for expr in misses:
+        a = dag.evaluate(dag.add(trees[expr]), X, NP_OPS, lru)
+        cache.put(expr, np.square(np.subtract(a, y)).mean())
+    cache.save()
+    
+    r = min(((cache.get(e), line) for e, line in zip(canon, funs)), key=nan_last)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, r[0], r[1], len(misses)
+
+def benchmark_blocked(csv_file, functions_file, block_rows=None):
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    y = X.pop("y")
+    
+    trees = parse_all(funs)
+    if block_rows is None:
+        block_rows = choose_block_rows(len(X), max(depth(t) for t in trees))
+    
+    dag = ExpressionDAG()
+    cache = LRUCache(CSE_CACHE_BYTES)
+    kernels = [partial(dag.evaluate, dag.add(t), ops=NP_OPS, cache=cache) for t in trees]
+    
+    start = time.perf_counter_ns()
+    sse = blocked_sse(kernels, X, y, block_rows, on_block=cache.clear)
+    r = min(zip((sse / len(y)).tolist(), funs), key=nan_last)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, r[0], r[1], block_rows
+
+def benchmark_racing(csv_file, functions_file):
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    y = X.pop("y")
+    
+    dag = ExpressionDAG()
+    cache = LRUCache(CSE_CACHE_BYTES)
+    kernels = [partial(dag.evaluate, dag.add(tree), ops=NP_OPS, cache=cache)
+               for tree in parse_all(funs)]
+    
+    start = time.perf_counter_ns()
+    exact, evaluated = race(kernels, X, y, on_slice=cache.clear)
+    cache.clear()
+    finalists = [i for i, mse in exact.items() if not np.isnan(mse)]
+    if finalists:
+        r = min(((np.square(np.subtract(kernels[i](X), y)).mean(), funs[i]) for i in finalists), key=nan_last)
+    else:
+        # Every expression scored NaN.
+        r = min(((exact[i], funs[i]) for i in sorted(exact)), key=nan_last)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    skipped = 1 - evaluated / (len(funs) * len(y))
+    return elapsed, r[0], r[1], skipped
+
+def benchmark_multiprocess(csv_file, functions_file, n_workers=None):
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    n_workers = n_workers or os.cpu_count()
+    shards = shard(funs, n_workers * 4)
+    
+    with SharedColumns(X) as columns, \
+            Pool(n_workers, initializer=attach_columns, initargs=columns.init_args()) as pool:
+        start = time.perf_counter_ns()
+        r = min(pool.map(score_shard, shards), key=nan_last)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, r[0], r[1]
+
+def benchmark_row_sharded(csv_file, functions_file, n_workers=None):
+    funs = [line.strip() for line in open(functions_file).readlines()]
+    X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    n_rows = len(X["y"])
+    n_workers = n_workers or os.cpu_count()
+    ranges = row_ranges(n_rows, n_workers)
+    
+    with SharedColumns(X) as columns, \
+            Pool(n_workers, initializer=attach_rows, initargs=(*columns.init_args(), funs)) as pool:
+        start = time.perf_counter_ns()
+        sse = np.sum(pool.map(rows_sse, ranges), axis=0)
+        r = min(zip((sse / n_rows).tolist(), funs), key=nan_last)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, r[0], r[1]
+
+def benchmark_stack_machine(csv_file, functions_file, profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        X = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    y = X.pop("y")
+    columns = list(X)
+    with profiler.phase("stack columns"):
+        data = np.stack([X[c] for c in columns])
+    
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    with profiler.phase("assemble"):
+        code, args, depths = assemble(trees, columns)
+    profiler.count("ops", count_stack_ops(code, len(y)))
+    
+    start = time.perf_counter_ns()
+    with profiler.phase("evaluate"):
+        mse = evaluate_mse(code, args, depths, data, y)
+    with profiler.phase("reduce"):
+        r = min(zip(mse.tolist(), funs), key=nan_last)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
     
     return elapsed, r[0], r[1]
 
 def generate_kernel_code(expr, input_cols):
     kernel_expr = expr
-    for k in OPS:
+    for k in UNARY_FUNS:
         kernel_expr = kernel_expr.replace(k, f"OPS['{k}']")
     
     for c in input_cols:
@@ -51,137 +217,473 @@ def kernel_func(X, OPS):
 """
     return kernel_code
 
-def compile_kernel(expr, input_cols):
+def compile_kernel(expr, input_cols, cache=None):
     kernel_code = generate_kernel_code(expr, input_cols)
+    if cache is not None:
+        return cache.function(kernel_code.strip(), "kernel_func")
     env = {}
     exec(kernel_code.strip(), {}, env)
     return env["kernel_func"]
 
-def benchmark_parallel(csv_file, functions_file):
-    df = pd.read_csv(csv_file)
-    funs = [line.strip() for line in open(functions_file).readlines()]
+def benchmark_parallel(csv_file, functions_file, cse=True, precision="float64", top_k=1,
+                       memory_budget=BATCH_MEMORY_BYTES, profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        columns = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
     
-    cols = list(df.columns)
-    target_col = cols[-1]
-    input_cols = cols[:-1]
+    cols = list(columns)
+    target_col = "y"
+    input_cols = [c for c in cols if c != target_col]
     
-    X = {c: torch.tensor(df[c].values, dtype=torch.float64, device=device)
-         for c in cols}
+    torch, device = torch_backend()
+    dtype = getattr(torch, precision)
+    with profiler.phase("tensors", device=str(device)):
+        X = {c: torch.tensor(columns[c], dtype=dtype, device=device)
+             for c in cols}
     y = X[target_col]
     
-    compiled = [compile_kernel(f, input_cols) for f in funs]
+    # memory_budget bounds the batches and the CSE cache together.
+    batch_bytes, cache_bytes = split_budget(memory_budget, cse)
     
-    start = time.time()
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    with profiler.phase("compile", cse=cse):
+        if cse:
+            dag = ExpressionDAG()
+            cache = LRUCache(cache_bytes)
+            compiled = [partial(dag.evaluate, dag.add(tree), cache=cache) for tree in trees]
+        else:
+            kernel_cache = KernelCache("torch")
+            compiled = [compile_kernel(f, input_cols, kernel_cache) for f in funs]
+            kernel_cache.save()
+    profiler.count("ops", count_dag_ops(dag, len(y)) if cse else count_ops(trees, len(y)))
     
-    best_err = float('inf')
-    best_expr = None
+    max_depth = max(depth(tree) for tree in trees)
+    ops = torch_fused_ops()
+    itemsize = torch.empty((), dtype=dtype).element_size()
+    max_size = max_batch_size(len(y), max_depth, itemsize, batch_bytes)
+    sync = torch.cuda.synchronize if device.type == "cuda" else None
+    batcher = AdaptiveBatcher(max_size, sync=sync)
     
-    for i in range(0, len(compiled), TASK_BATCH):
-        block = compiled[i:i + TASK_BATCH]
-        preds = torch.stack([kernel(X, OPS) for kernel in block])
-        errs = torch.mean((preds - y) ** 2, dim=1)
-        
-        for j, err in enumerate(errs):
-            idx_global = i + j
-            err_val = err.item()
-
-            if err_val < best_err:
-                best_err = err_val
-                best_expr = funs[idx_global]
-        
-        del preds, errs
-        torch.cuda.empty_cache()
+    start = time.perf_counter_ns()
     
-    elapsed = time.time() - start
+    leaders = DeviceTopK(top_k, dtype, device)
     
-    return elapsed, best_err, best_expr
-
-
-print("=" * 100)
-print(f"CPU vs GPU Benchmark - Device: {device}")
-print("=" * 100 + "\n")
-
-test_files = sorted(glob.glob("test_cases/data_*.csv"))
+    for i, stop in batcher.batches(len(compiled)):
+        with profiler.phase("batch", start=i, size=stop - i):
+            block = compiled[i:stop]
+            preds = torch.stack([kernel(X, ops) for kernel in block])
+            errs = torch.mean((preds - y) ** 2, dim=1)
+            leaders.update(errs, i)
+            del preds, errs
+    
+    with profiler.phase("reduce"):
+        board = leaders.result(funs)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, board[0][0], board[0][1], board, batcher.sizes
 
-if not test_files:
-    print("ERROR: No test files found in test_cases/")
-    print("Run 'python generate_inputs.py' first!")
-    exit(1)
+def benchmark_graph(csv_file, functions_file, mode="trace", precision="float64", top_k=1,
+                    memory_budget=BATCH_MEMORY_BYTES, profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        columns = load_columns(csv_file, columns=referenced_columns(funs) | {"y"})
+    
+    torch, device = torch_backend()
+    dtype = getattr(torch, precision)
+    with profiler.phase("tensors", device=str(device)):
+        X = {c: torch.tensor(columns[c], dtype=dtype, device=device)
+             for c in columns}
+    y = X["y"]
+    
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    
+    step = min(GRAPH_BATCH, max_batch_size(len(y), max(depth(t) for t in trees),
+                                           y.element_size(), memory_budget))
+    compile_seconds = 0.0
+    built = 0
+    batches = []
+    with profiler.phase("compile", mode=mode):
+        for i in range(0, len(trees), step):
+            graph, cols, seconds, cached = graph_kernel(trees[i:i + step], mode, X, y,
+                                                        scope=os.path.abspath(functions_file))
+            batches.append((i, graph, [X[c] for c in cols]))
+            compile_seconds += seconds
+            built += not cached
+    
+    start = time.perf_counter_ns()
+    
+    leaders = DeviceTopK(top_k, dtype, device)
+    
+    for i, graph, args in batches:
+        with profiler.phase("batch", start=i):
+            leaders.update(graph(y, *args), i)
+    
+    with profiler.phase("reduce"):
+        board = leaders.result(funs)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, board[0][0], board[0][1], board, compile_seconds, built
 
-results = []
+def benchmark_fused(csv_file, functions_file, backend="torch", precision="float64", top_k=1,
+                    profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        columns = load_columns(csv_file, PRECISIONS[precision], columns=referenced_columns(funs) | {"y"})
+    
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    with profiler.phase("compile"):
+        batches = compile_batches(funs, trees, TASK_BATCH)
+    n_regs = max(1, max(n for _, n in batches))
+    n_rows = len(columns["y"])
+    profiler.count("ops", count_ops(trees, n_rows))
+    
+    if backend == "torch":
+        torch, device = torch_backend()
+        ops = torch_fused_ops()
+        dtype = getattr(torch, precision)
+        with profiler.phase("tensors", device=str(device)):
+            X = {c: torch.tensor(columns[c], dtype=dtype, device=device)
+                 for c in columns}
+        scratch = torch.empty((n_regs, n_rows), dtype=dtype, device=device)
+        out = torch.empty((TASK_BATCH, n_rows), dtype=dtype, device=device)
+        mse = torch.empty(len(funs), dtype=dtype, device=device)
+    else:
+        ops = FUSED_NP_OPS
+        X = columns
+        dtype = PRECISIONS[precision]
+        scratch = np.empty((n_regs, n_rows), dtype=dtype)
+        out = np.empty((TASK_BATCH, n_rows), dtype=dtype)
+        mse = np.empty(len(funs), dtype=dtype)
+    y = X["y"]
+    
+    start = time.perf_counter_ns()
+    
+    for b, (kernel, _) in enumerate(batches):
+        i = b * TASK_BATCH
+        k = min(TASK_BATCH, len(funs) - i)
+        preds = out[:k]
+        with profiler.phase("batch", start=i, size=k):
+            kernel(X, ops, scratch, preds)
+            if backend == "torch":
+                preds.sub_(y).square_()
+                torch.mean(preds, dim=1, out=mse[i:i + k])
+            else:
+                np.subtract(preds, y, out=preds)
+                np.square(preds, out=preds)
+                np.mean(preds, axis=1, out=mse[i:i + k])
+    
+    with profiler.phase("reduce"):
+        if backend == "torch":
+            leaders = DeviceTopK(top_k, dtype, device)
+            leaders.update(mse, 0)
+            board = leaders.result(funs)
+        else:
+            board = stream_top_k(zip(mse.tolist(), funs), top_k)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    
+    return elapsed, board[0][0], board[0][1], board
 
-for csv_file in test_files:
-    name = os.path.basename(csv_file).replace("data_", "").replace(".csv", "")
-    functions_file = csv_file.replace("data_", "functions_").replace(".csv", ".txt")
+def benchmark_buckets(csv_file, functions_file, backend="numpy", precision="float64", top_k=1,
+                      profiler=NULL_PROFILER):
+    with profiler.phase("load"):
+        funs = [line.strip() for line in open(functions_file).readlines()]
+        X = load_columns(csv_file, PRECISIONS[precision], columns=referenced_columns(funs) | {"y"})
     
-    df = pd.read_csv(csv_file)
-    n_rows = len(df)
-    n_functions = sum(1 for _ in open(functions_file))
+    y = X.pop("y")
+    columns = list(X)
+    with profiler.phase("stack columns"):
+        data = np.stack([X[c] for c in columns])
     
-    print(f"Testing: {name}")
-    print(f"  Rows: {n_rows:,}, Functions: {n_functions:,}")
+    with profiler.phase("parse"):
+        trees = parse_all(funs)
+    with profiler.phase("bucketize"):
+        buckets = bucketize(trees, columns)
+    profiler.count("ops", count_ops(trees, len(y)))
     
-    # CPU
-    print("  Running CPU version...", end=" ", flush=True)
-    cpu_time, cpu_mse, cpu_expr = benchmark_sequential(csv_file, functions_file)
-    print(f"✓ {cpu_time:.4f}s")
+    if backend == "torch":
+        torch, device = torch_backend()
+        ops = torch_fused_ops()
+        dtype = getattr(torch, precision)
+        with profiler.phase("tensors", device=str(device)):
+            data = torch.tensor(data, dtype=dtype, device=device)
+            y = torch.tensor(y, dtype=dtype, device=device)
+            buckets = [b.to(partial(torch.as_tensor, device=device)) for b in buckets]
+        mse = torch.empty(len(funs), dtype=dtype, device=device)
+    else:
+        ops = FUSED_NP_OPS
+        mse = np.empty(len(funs), dtype=data.dtype)
     
-    # GPU
-    print("  Running GPU version...", end=" ", flush=True)
-    gpu_time, gpu_mse, gpu_expr = benchmark_parallel(csv_file, functions_file)
-    print(f"✓ {gpu_time:.4f}s")
+    start = time.perf_counter_ns()
+    with profiler.phase("evaluate", buckets=len(buckets)):
+        bucket_mse(buckets, data, y, ops, mse)
+    with profiler.phase("reduce"):
+        if backend == "torch":
+            leaders = DeviceTopK(top_k, dtype, device)
+            leaders.update(mse, 0)
+            board = leaders.result(funs)
+        else:
+            board = stream_top_k(zip(mse.tolist(), funs), top_k)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
     
-    # Speedup
-    speedup = cpu_time / gpu_time
-    winner = "GPU" if speedup > 1.0 else "CPU"
+    return elapsed, board[0][0], board[0][1], board, len(buckets)
+
+def benchmark_auto(csv_file, functions_file, model_file=MODEL_FILE):
+    model = CostModel.load(model_file)
+    key, predicted = model.choose(*workload(csv_file, functions_file))
+    _, _, fn, kwargs, _ = next(e for e in ENGINES if e[0] == key)
     
-    print(f"  Speedup: {speedup:.2f}x ({winner} wins!)")
-    print()
+    elapsed, best_err, best_expr = fn(csv_file, functions_file, **kwargs)[:3]
     
-    results.append({
-        "name": name,
-        "rows": n_rows,
-        "functions": n_functions,
-        "cpu_time": cpu_time,
-        "gpu_time": gpu_time,
-        "speedup": speedup,
-        "winner": winner,
-        "mse": cpu_mse
-    })
+    return elapsed, best_err, best_expr, key, predicted, elapsed / predicted - 1
+
+ENGINES = [
+    ("cpu", "CPU", benchmark_sequential, {}, None),
+    ("cached", "cached CPU", benchmark_cached, {}, lambda r: f"{r[3]:,} expressions scored"),
+    ("blocked", "blocked CPU", benchmark_blocked, {}, lambda r: f"block of {r[3]:,} rows"),
+    ("racing", "racing CPU", benchmark_racing, {}, lambda r: f"{r[3]:.1%} of row evaluations skipped"),
+    ("multiprocess", "multi-process CPU", benchmark_multiprocess, {}, None),
+    ("row_sharded", "row-sharded CPU", benchmark_row_sharded, {}, None),
+    ("stack_machine", "stack-machine CPU", benchmark_stack_machine, {}, None),
+    ("gpu", "GPU", benchmark_parallel, {}, lambda r: f"{len(r[4]):,} batches of up to {max(r[4]):,}"),
+    ("gpu_graph", "GPU compiled graphs", benchmark_graph, {},
+     lambda r: f"compiling took {r[4]:.3f}s, not timed; {r[5]:,} graphs built on this call"),
+    ("fused_numpy", "fused NumPy", benchmark_fused, {"backend": "numpy"}, None),
+    ("fused_torch", "fused torch", benchmark_fused, {"backend": "torch"}, None),
+    ("buckets_numpy", "shape-bucketed NumPy", benchmark_buckets, {"backend": "numpy"},
+     lambda r: f"{r[4]:,} shapes"),
+    ("buckets_torch", "shape-bucketed torch", benchmark_buckets, {"backend": "torch"},
+     lambda r: f"{r[4]:,} shapes"),
+    ("auto", "auto", benchmark_auto, {},
+     lambda r: f"ran {r[3]}, predicted {r[4]:.4f}s, prediction off by {r[5]:+.0%}"),
+]
+
+# Engines the cost model is calibrated for, and that auto chooses from.
+AUTO_ENGINES = ["cpu", "blocked", "stack_machine", "gpu", "fused_numpy", "fused_torch",
+                "buckets_numpy", "buckets_torch"]
+
+# Engines that take a precision argument; the others always run in float64.
+PRECISION_ENGINES = {"cpu", "gpu", "gpu_graph", "fused_numpy", "fused_torch", "buckets_numpy",
+                     "buckets_torch"}
+
+# Engines that can return the k best expressions instead of only the best one.
+LEADERBOARD_ENGINES = {"cpu", "gpu", "gpu_graph", "fused_numpy", "fused_torch", "buckets_numpy",
+                       "buckets_torch"}
+
+# Engines instrumented with phases, batches and operation counts.
+PROFILED_ENGINES = {"cpu", "stack_machine", "gpu", "gpu_graph", "fused_numpy", "fused_torch", "buckets_numpy",
+                    "buckets_torch"}
+
+# Engines that import torch.
+TORCH_ENGINES = {"gpu", "gpu_graph", "fused_torch", "buckets_torch"}
+
+# Engines that can run without sharing common subexpressions.
+CSE_ENGINES = {"cpu", "gpu"}
+
+def engine_kwargs(key, kwargs, precision="float64", top_k=1, memory_budget=BATCH_MEMORY_BYTES,
+                  graph_mode=None, cse=True):
+    """kwargs of an ENGINES entry plus the options of the command line that
+    the engine supports."""
+    if key == "gpu_graph":
+        kwargs = {**kwargs, "mode": graph_mode or GRAPH_MODES[0]}
+    if precision != "float64":
+        kwargs = {**kwargs, "precision": precision}
+    if key in LEADERBOARD_ENGINES:
+        kwargs = {**kwargs, "top_k": top_k}
+    if key in ("gpu", "gpu_graph"):
+        kwargs = {**kwargs, "memory_budget": memory_budget}
+    if not cse and key in CSE_ENGINES:
+        kwargs = {**kwargs, "cse": False}
+    return kwargs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU vs GPU expression evaluation benchmark")
+    parser.add_argument("--warmup", type=int, default=2, help="warmup iterations per fork")
+    parser.add_argument("--iterations", type=int, default=5, help="measurement iterations per fork")
+    parser.add_argument("--forks", type=int, default=0, help="fresh interpreters per benchmark (0 runs in-process)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JMH-style JSON results file")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="float64",
+                        help="float32 runs only the engines that support it, plus an accuracy report")
+    parser.add_argument("--top-k", type=int, default=1, help="size of the leaderboard of best expressions")
+    parser.add_argument("--batch-memory", type=int, default=BATCH_MEMORY_BYTES // 1024 ** 2,
+                        help="memory budget of the GPU engines, in MiB: the batches of gpu and gpu_graph, "
+                             "plus the cache of common subexpressions of gpu, which gets half")
+    parser.add_argument("--profile", default=None, metavar="DIR",
+                        help="after measuring, profile one more run per engine and write Chrome traces to DIR")
+    parser.add_argument("--cprofile", action="store_true", help="with --profile, also write cProfile stats")
+    parser.add_argument("--graph-mode", choices=GRAPH_MODES, default=None,
+                        help="also run the GPU engine with each batch traced (TorchScript) or torch.compile'd")
+    parser.add_argument("--no-cse", action="store_true",
+                        help="run the cpu and gpu engines without sharing common subexpressions, "
+                             "each expression compiled on its own")
+    parser.add_argument("--calibrate", action="store_true",
+                        help=f"fit the cost model used by the auto engine on this machine and save it to {MODEL_FILE}")
+    parser.add_argument("--engine", action="append", choices=[e[0] for e in ENGINES], default=None,
+                        help="run only this engine (repeatable); the default runs all of them")
+    parser.add_argument("--filter", default="*", metavar="PATTERN",
+                        help="run only the test cases whose name matches this glob pattern")
+    args = parser.parse_args(argv)
+    selected = args.engine or [e[0] for e in ENGINES]
+
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+
+    if args.calibrate:
+        print(f"Calibrating the cost model for {', '.join(AUTO_ENGINES)}...")
+        engines = {key: partial(fn, **kwargs) for key, _, fn, kwargs, _ in ENGINES if key in AUTO_ENGINES}
+        calibrate(engines, torch_backend()[1]).save(MODEL_FILE)
+        print(f"Cost model written to {MODEL_FILE}\n")
+    has_model = os.path.exists(MODEL_FILE)
+
+    device = torch_backend()[1] if TORCH_ENGINES & set(selected) else "cpu"
+    print("=" * 100)
+    print(f"CPU vs GPU Benchmark - Device: {device}")
+    print(f"Warmup: {args.warmup}, Iterations: {args.iterations}, Forks: {args.forks}, "
+          f"Precision: {args.precision}")
+    print("=" * 100 + "\n")
+
+    test_files = sorted(f for f in glob.glob("test_cases/data_*.csv")
+                        if fnmatch.fnmatch(os.path.basename(f)[5:-4], args.filter))
+
+    if not test_files:
+        print("ERROR: No test files found in test_cases/")
+        print("Run 'python generate_inputs.py' first!")
+        exit(1)
+
+    results = []
+    entries = []
+
+    for csv_file in test_files:
+        name = os.path.basename(csv_file).replace("data_", "").replace(".csv", "")
+        functions_file = csv_file.replace("data_", "functions_").replace(".csv", ".txt")
+        
+        n_rows = len(load_columns(csv_file, columns={"y"})["y"])
+        n_functions = sum(1 for _ in open(functions_file))
+        
+        print(f"Testing: {name}")
+        print(f"  Rows: {n_rows:,}, Functions: {n_functions:,}")
+        
+        times = {}
+        outputs = {}
+        for key, label, fn, kwargs, detail in ENGINES:
+            if key not in selected or key == "auto" and not has_model:
+                continue
+            if key == "gpu_graph" and args.graph_mode is None and args.engine is None:
+                continue
+            if args.precision != "float64" and key not in PRECISION_ENGINES:
+                continue
+            kwargs = engine_kwargs(key, kwargs, args.precision, args.top_k, args.batch_memory * 1024 ** 2,
+                                   args.graph_mode, not args.no_cse)
+            print(f"  Running {label} version...", end=" ", flush=True)
+            params = {"testCase": name, "rows": n_rows, "functions": n_functions, "engine": key,
+                      "precision": args.precision}
+            entry, outputs[key] = measure(fn, (csv_file, functions_file), kwargs, params,
+                                          args.warmup, args.iterations, args.forks)
+            entries.append(entry)
+            metric = entry["primaryMetric"]
+            times[key] = metric["score"] / 1000
+            extra = f" ({detail(outputs[key])})" if detail else ""
+            print(f"✓ {times[key]:.4f}s ± {metric['scoreError'] / 1000:.4f}{extra}")
+            if args.profile and key in PROFILED_ENGINES:
+                base = os.path.join(args.profile, f"{name}.{key}")
+                profiler, _ = profile_run(fn, (csv_file, functions_file), kwargs, f"{name}.{key}",
+                                          base + ".trace.json", base + ".prof" if args.cprofile else None)
+                phases = ", ".join(f"{phase} {t:.4f}s" for phase, t in profiler.totals().items())
+                print(f"    profile: {phases}")
+        
+        # Measured on the first selected engine that ran in float32, not on
+        # one the command line left out.
+        checked = [e for e in ENGINES if e[0] in outputs and e[0] in PRECISION_ENGINES]
+        if args.precision != "float64" and checked:
+            key, label, fn, kwargs, _ = checked[0]
+            if key == "gpu_graph":
+                kwargs = {**kwargs, "mode": args.graph_mode or GRAPH_MODES[0]}
+            report = accuracy_report(fn, csv_file, functions_file, **kwargs)
+            print(f"  Accuracy vs float64 ({label}): same best = {report['same_best']}, "
+                  f"MSE rel. error = {report['mse_rel_error']:.2e}, regret = {report['regret']:.2e}")
+        
+        if "auto" in outputs:
+            chosen = outputs["auto"][3]
+            measured = [k for k in AUTO_ENGINES if k in times]
+            if chosen in times and measured:
+                fastest = min(measured, key=times.get)
+                print(f"  Auto chose {chosen} ({times[chosen]:.4f}s), fastest was {fastest} ({times[fastest]:.4f}s)")
+            else:
+                print(f"  Auto chose {chosen}")
+        
+        boards = [k for k in outputs if k in LEADERBOARD_ENGINES]
+        if args.top_k > 1 and boards:
+            print(f"  Top {args.top_k} expressions:")
+            for rank, (err, expr) in enumerate(outputs[boards[0]][3], 1):
+                print(f"    {rank:>3}. {err:.6e}  {expr}")
+        
+        if "cpu" in times and "gpu" in times:
+            cpu_time = times["cpu"]
+            gpu_time = times["gpu"]
+            
+            # Speedup
+            speedup = cpu_time / gpu_time
+            winner = "GPU" if speedup > 1.0 else "CPU"
+            
+            print(f"  Speedup: {speedup:.2f}x ({winner} wins!)")
+            
+            results.append({
+                "name": name,
+                "rows": n_rows,
+                "functions": n_functions,
+                "cpu_time": cpu_time,
+                "gpu_time": gpu_time,
+                "times": times,
+                "speedup": speedup,
+                "winner": winner,
+                "mse": outputs["cpu"][1]
+            })
+        print()
+
+    write_results(entries, args.output)
+
+    if results:
+        print("=" * 100)
+        print("BENCHMARK RESULTS SUMMARY")
+        print("=" * 100)
+        print(f"{'Test Case':<20} {'Rows':<10} {'Funcs':<8} {'CPU(s)':<10} {'GPU(s)':<10} {'Speedup':<10} {'Winner'}")
+        print("-" * 100)
 
+        for r in results:
+            print(f"{r['name']:<20} {r['rows']:<10,} {r['functions']:<8,} "
+                  f"{r['cpu_time']:<10.4f} {r['gpu_time']:<10.4f} "
+                  f"{r['speedup']:<10.2f}x {r['winner']}")
 
-print("=" * 100)
-print("BENCHMARK RESULTS SUMMARY")
-print("=" * 100)
-print(f"{'Test Case':<20} {'Rows':<10} {'Funcs':<8} {'CPU(s)':<10} {'GPU(s)':<10} {'Speedup':<10} {'Winner'}")
-print("-" * 100)
+        print("\n" + "=" * 100)
+        print("KEY INSIGHTS:")
+        print("=" * 100)
 
-for r in results:
-    print(f"{r['name']:<20} {r['rows']:<10,} {r['functions']:<8,} "
-          f"{r['cpu_time']:<10.4f} {r['gpu_time']:<10.4f} "
-          f"{r['speedup']:<10.2f}x {r['winner']}")
+        cpu_wins = sum(1 for r in results if r['winner'] == 'CPU')
+        gpu_wins = sum(1 for r in results if r['winner'] == 'GPU')
 
-print("\n" + "=" * 100)
-print("KEY INSIGHTS:")
-print("=" * 100)
+        print(f"CPU wins: {cpu_wins}/{len(results)}")
+        print(f"GPU wins: {gpu_wins}/{len(results)}")
+        print(f"Best speedup: {max(r['speedup'] for r in results):.2f}x ({max(results, key=lambda x: x['speedup'])['name']})")
+        print(f"Worst speedup: {min(r['speedup'] for r in results):.2f}x ({min(results, key=lambda x: x['speedup'])['name']})")
 
-cpu_wins = sum(1 for r in results if r['winner'] == 'CPU')
-gpu_wins = sum(1 for r in results if r['winner'] == 'GPU')
+        transition = None
+        for i, r in enumerate(results):
+            if i > 0 and results[i-1]['winner'] == 'CPU' and r['winner'] == 'GPU':
+                transition = r
+                break
 
-print(f"CPU wins: {cpu_wins}/{len(results)}")
-print(f"GPU wins: {gpu_wins}/{len(results)}")
-print(f"Best speedup: {max(r['speedup'] for r in results):.2f}x ({max(results, key=lambda x: x['speedup'])['name']})")
-print(f"Worst speedup: {min(r['speedup'] for r in results):.2f}x ({min(results, key=lambda x: x['speedup'])['name']})")
+        if transition:
+            print(f"\nTransition point: {transition['name']}")
+            print(f"  → {transition['rows']:,} rows × {transition['functions']:,} functions")
+            print(f"  → Complexity: {transition['rows'] * transition['functions']:,}")
 
-transition = None
-for i, r in enumerate(results):
-    if i > 0 and results[i-1]['winner'] == 'CPU' and r['winner'] == 'GPU':
-        transition = r
-        break
+    if not has_model:
+        print(f"No {MODEL_FILE}: run with --calibrate to enable the auto engine.")
+    print("=" * 100)
+    print(f"Results written to {args.output}")
 
-if transition:
-    print(f"\nTransition point: {transition['name']}")
-    print(f"  → {transition['rows']:,} rows × {transition['functions']:,} functions")
-    print(f"  → Complexity: {transition['rows'] * transition['functions']:,}")
 
-print("=" * 100)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from expression_client import AsyncExpressionClient
+from harness import summarize
+
+CONCURRENCY = [1, 4, 16]
+
+
+async def client_run(address, dataset, funs, n_requests, batch, offset):
+    latencies = []
+    async with await AsyncExpressionClient.connect(address) as client:
+        for r in range(n_requests):
+            start = (offset + r * batch) % len(funs)
+            exprs = [funs[(start + j) % len(funs)] for j in range(batch)]
+            t0 = time.perf_counter_ns()
+            await client.score(dataset, exprs)
+            latencies.append((time.perf_counter_ns() - t0) / 1e6)
+    return latencies
+
+
+async def run_level(address, dataset, funs, concurrency, n_requests, batch):
+    async with await AsyncExpressionClient.connect(address) as client:
+        before = await client.stats()
+    start = time.perf_counter_ns()
+    runs = await asyncio.gather(*[client_run(address, dataset, funs, n_requests, batch, i * 7919)
+                                  for i in range(concurrency)])
+    wall = (time.perf_counter_ns() - start) / 1e9
+    async with await AsyncExpressionClient.connect(address) as client:
+        after = await client.stats()
+    requests = after["requests"] - before["requests"]
+    batches = max(1, after["batches"] - before["batches"])
+    return [t for run in runs for t in run], wall, requests / batches
+
+
+async def wait_for_server(address, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            client = await AsyncExpressionClient.connect(address)
+            await client.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def benchmark(args, address):
+    dataset = os.path.abspath(f"test_cases/data_{args.test_case}.csv")
+    functions_file = f"test_cases/functions_{args.test_case}.txt"
+    funs = [line.strip() for line in open(functions_file).readlines()]
+
+    await wait_for_server(address)
+
+    async with await AsyncExpressionClient.connect(address) as client:
+        t0 = time.perf_counter_ns()
+        await client.score(dataset, funs[:args.batch])
+        cold = (time.perf_counter_ns() - t0) / 1e6
+    print(f"First request (loads the dataset): {cold:.1f} ms")
+    print()
+    print(f"{'Clients':<8} {'p50(ms)':<10} {'p99(ms)':<10} {'mean(ms)':<10} {'expr/s':<12} {'req/batch'}")
+    print("-" * 60)
+
+    for concurrency in args.concurrency:
+        latencies, wall, coalesced = await run_level(address, dataset, funs, concurrency,
+                                                     args.requests, args.batch)
+        stats = summarize(latencies)
+        p = stats["scorePercentiles"]
+        throughput = len(latencies) * args.batch / wall
+        print(f"{concurrency:<8} {p['50.0']:<10.2f} {p['99.0']:<10.2f} {stats['score']:<10.2f} "
+              f"{throughput:<12,.0f} {coalesced:.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency of the resident expression server")
+    parser.add_argument("--address", default=None,
+                        help="a running server (socket path or host:port); by default one is started")
+    parser.add_argument("--test-case", default="small_simple")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--batch", type=int, default=16, help="expressions per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    if args.address is not None:
+        asyncio.run(benchmark(args, args.address))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, "server.sock")
+        server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expression_server.py")
+        server = subprocess.Popen([sys.executable, server_script, "--unix", address])
+        try:
+            asyncio.run(benchmark(args, address))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from collections import defaultdict
+
+import numpy as np
+
+from expressions import UNARY_FUNS, BINARY_OPS
+from expression_dag import nbytes
+
+BUCKET_BUDGET_BYTES = 64 * 1024 ** 2
+
+# A shape is a tree with the leaf columns, unary functions and binary
+# operators left out:
+#   ("col",)
+#   ("un", child)
+#   ("bin", left, right)
+
+
+def shape(node):
+    kind = node[0]
+    if kind == "col":
+        return ("col",)
+    if kind == "un":
+        return ("un", shape(node[2]))
+    return ("bin", shape(node[2]), shape(node[3]))
+
+
+def parameters(node, col_index, cols=None, funs=None, signs=None):
+    """What shape() leaves out, in preorder: the column index of every leaf,
+    the UNARY_FUNS index of every unary node and the sign (+1 or -1) of the
+    right operand of every binary node."""
+    if cols is None:
+        cols, funs, signs = [], [], []
+    kind = node[0]
+    if kind == "col":
+        cols.append(col_index[node[1]])
+    elif kind == "un":
+        funs.append(UNARY_FUNS.index(node[1]))
+        parameters(node[2], col_index, cols, funs, signs)
+    else:
+        signs.append(1.0 if node[1] == BINARY_OPS[0] else -1.0)
+        parameters(node[2], col_index, cols, funs, signs)
+        parameters(node[3], col_index, cols, funs, signs)
+    return cols, funs, signs
+
+
+class Bucket:
+    """Trees of one shape. cols holds the leaf columns as an (n_trees, n_leaves)
+    array; every unary node gets a list of (function, mask) pairs, with a
+    mask of None when all the trees use the same function, and every binary
+    node gets "+", "-" or a vector of signs when the trees disagree."""
+
+    def __init__(self, shape, indices, cols, funs, signs):
+        self.shape = shape
+        self.indices = np.array(indices)
+        self.cols = np.array(cols, dtype=np.intp).reshape(len(indices), -1)
+        self.height = height(shape)
+
+        funs = np.array(funs, dtype=np.intp).reshape(len(indices), -1)
+        self.unary = []
+        for f in funs.T:
+            present = np.unique(f)
+            if len(present) == 1:
+                self.unary.append([(UNARY_FUNS[present[0]], None)])
+            else:
+                self.unary.append([(UNARY_FUNS[k], f == k) for k in present])
+
+        signs = np.array(signs).reshape(len(indices), -1)
+        self.binary = []
+        for sign in signs.T:
+            if (sign > 0).all():
+                self.binary.append(BINARY_OPS[0])
+            elif (sign < 0).all():
+                self.binary.append(BINARY_OPS[1])
+            else:
+                self.binary.append(sign[:, None])
+
+    def to(self, convert):
+        """The bucket with its arrays passed through convert, e.g. to move
+        them to a torch device."""
+        moved = object.__new__(Bucket)
+        moved.shape = self.shape
+        moved.indices = convert(self.indices)
+        moved.height = self.height
+        moved.cols = convert(self.cols)
+        moved.unary = [[(name, mask if mask is None else convert(mask)) for name, mask in node]
+                       for node in self.unary]
+        moved.binary = [op if isinstance(op, str) else convert(op) for op in self.binary]
+        return moved
+
+
+def height(s):
+    """Values alive at once while evaluating a shape depth-first."""
+    if s[0] == "col":
+        return 1
+    if s[0] == "un":
+        return height(s[1])
+    return max(height(s[1]), height(s[2]) + 1)
+
+
+def bucketize(trees, columns):
+    """Groups trees by shape, largest bucket first."""
+    col_index = {c: i for i, c in enumerate(columns)}
+    groups = defaultdict(list)
+    for i, tree in enumerate(trees):
+        groups[shape(tree)].append((i, parameters(tree, col_index)))
+    buckets = []
+    for s, members in groups.items():
+        indices = [i for i, _ in members]
+        cols, funs, signs = zip(*(p for _, p in members))
+        buckets.append(Bucket(s, indices, cols, funs, signs))
+    buckets.sort(key=lambda b: -len(b.indices))
+    return buckets
+
+
+def evaluate_bucket(bucket, data, ops, rows=slice(None)):
+    """(n_trees, n_rows) predictions of the trees selected by rows, over the
+    (n_cols, n_rows) data matrix, which is a NumPy array or a tensor on the
+    same device as the bucket. Every node of the shape is one gather or one
+    call per distinct function, whatever the number of trees. ops maps the
+    names in UNARY_FUNS and BINARY_OPS to functions that take an out
+    argument, like FUSED_NP_OPS."""
+    cols = bucket.cols[rows]
+    pos = [0, 0, 0]
+
+    def walk(s):
+        """Values of subtree s, in a buffer the caller may overwrite."""
+        if s[0] == "col":
+            values = data[cols[:, pos[0]]]
+            pos[0] += 1
+            return values
+        if s[0] == "un":
+            node = bucket.unary[pos[1]]
+            pos[1] += 1
+            values = walk(s[1])
+            for name, mask in node:
+                if mask is None:
+                    return ops[name](values, out=values)
+                mask = mask[rows]
+                values[mask] = ops[name](values[mask])
+            return values
+        op = bucket.binary[pos[2]]
+        pos[2] += 1
+        left = walk(s[1])
+        right = walk(s[2])
+        if not isinstance(op, str):
+            right *= op[rows]
+            op = BINARY_OPS[0]
+        return ops[op](left, right, out=left)
+
+    return walk(bucket.shape)
+
+
+def bucket_mse(buckets, data, y, ops, mse, budget_bytes=BUCKET_BUDGET_BYTES):
+    """Fills mse (indexed like the original trees) with the MSE of every tree,
+    evaluating each bucket in chunks whose temporaries fit in budget_bytes."""
+    row_bytes = nbytes(data[0])
+    for bucket in buckets:
+        chunk = max(1, budget_bytes // ((bucket.height + 2) * row_bytes))
+        for start in range(0, len(bucket.indices), chunk):
+            rows = slice(start, start + chunk)
+            preds = evaluate_bucket(bucket, data, ops, rows)
+            preds -= y
+            mse[bucket.indices[rows]] = (preds * preds).mean(1)
+    return mse
@@ -0,0 +1,181 @@
+import numpy as np
+
+NOP, PUSH, ADD, SUB, SIN, COS, TAN, SQRT, EXP = range(9)
+
+OPCODES = {
+    "+": ADD,
+    "-": SUB,
+    "sinf": SIN,
+    "cosf": COS,
+    "tanf": TAN,
+    "sqrtf": SQRT,
+    "expf": EXP
+}
+
+UNARY_IMPL = {
+    SIN: np.sin,
+    COS: np.cos,
+    TAN: np.tan,
+    SQRT: np.sqrt,
+    EXP: np.exp
+}
+
+BINARY_IMPL = {
+    ADD: np.add,
+    SUB: np.subtract
+}
+
+# Programs run in lockstep at once, and the rows of each block they walk.
+CHUNK_PROGRAMS = 1024
+BLOCK_ROWS = 512
+
+# Shortest run of neighbouring programs computed on a slice of the stack
+# rather than gathered, and most runs per opcode and step.
+MIN_RUN = 4
+MAX_RUNS = 8
+
+
+def lower(node, col_index, program=None):
+    """Appends the postfix bytecode of an AST to program as (opcode, arg) pairs."""
+    if program is None:
+        program = []
+    kind = node[0]
+    if kind == "col":
+        program.append((PUSH, col_index[node[1]]))
+    elif kind == "un":
+        lower(node[2], col_index, program)
+        program.append((OPCODES[node[1]], 0))
+    else:
+        lower(node[2], col_index, program)
+        lower(node[3], col_index, program)
+        program.append((OPCODES[node[1]], 0))
+    return program
+
+
+def stack_depth(program):
+    sp = top = 0
+    for op, _ in program:
+        if op == PUSH:
+            sp += 1
+        elif op in BINARY_IMPL:
+            sp -= 1
+        top = max(top, sp)
+    return top
+
+
+def assemble(trees, columns):
+    """Lowers a population into padded (n_programs, max_len) opcode and
+    argument arrays. Short programs are padded with NOP."""
+    col_index = {c: i for i, c in enumerate(columns)}
+    programs = [lower(t, col_index) for t in trees]
+    max_len = max(len(p) for p in programs)
+    code = np.zeros((len(programs), max_len), dtype=np.int8)
+    args = np.zeros((len(programs), max_len), dtype=np.int16)
+    for i, p in enumerate(programs):
+        code[i, :len(p)] = [op for op, _ in p]
+        args[i, :len(p)] = [arg for _, arg in p]
+    depths = np.array([stack_depth(p) for p in programs])
+    return code, args, depths
+
+
+def run_uniform(op, arg, sp, stack, data):
+    """Fast path for a run of programs that all execute op at the same stack
+    height: plain slices, computed in place."""
+    if op == PUSH:
+        np.take(data, arg, axis=0, out=stack[:, sp])
+    elif op in UNARY_IMPL:
+        UNARY_IMPL[op](stack[:, sp - 1], out=stack[:, sp - 1])
+    else:
+        BINARY_IMPL[op](stack[:, sp - 2], stack[:, sp - 1], out=stack[:, sp - 2])
+
+
+def schedule(code, args, n_stack):
+    """The NumPy calls of every step of a lockstep chunk. They depend only on
+    the code, so they are worked out once and replayed over every block of
+    rows. Programs that run the same opcode at the same stack height and sit
+    next to each other in the chunk (at least MIN_RUN of them, and only the
+    MAX_RUNS longest such runs) are computed in place on a slice of the
+    stack, as (op, args, lo, hi, sp); the rest of the programs running that
+    opcode are gathered and scattered in one call, as (op, args, None, None,
+    top) with the flat slot index of each stack top."""
+    n_programs, n_steps = code.shape
+    base = np.arange(n_programs) * n_stack
+    sp = np.zeros(n_programs, dtype=np.intp)
+    calls = []
+
+    for t in range(n_steps):
+        step = code[:, t]
+        for op in np.unique(step):
+            if op == NOP:
+                continue
+            idx = np.nonzero(step == op)[0]
+            breaks = np.flatnonzero((np.diff(idx) != 1) | (np.diff(sp[idx]) != 0)) + 1
+            gathered = []
+            runs = np.split(idx, breaks)
+            longest = sorted(map(len, runs), reverse=True)[:MAX_RUNS]
+            min_run = max(MIN_RUN, longest[-1])
+            for run_idx in runs:
+                if len(run_idx) >= min_run:
+                    lo, hi = run_idx[0], run_idx[-1] + 1
+                    calls.append((op, args[lo:hi, t], lo, hi, int(sp[lo])))
+                else:
+                    gathered.append(run_idx)
+            if gathered:
+                rest = np.concatenate(gathered)
+                calls.append((op, args[rest, t], None, None, base[rest] + sp[rest] - 1))
+            sp[idx] += 1 if op == PUSH else -1 if op in BINARY_IMPL else 0
+
+    return calls
+
+
+def run(calls, n_programs, n_stack, data):
+    """Runs the scheduled calls of a chunk of programs in lockstep over the
+    (n_cols, n_rows) data matrix and returns their (n_programs, n_rows)
+    results."""
+    stack = np.empty((n_programs, n_stack, data.shape[1]), dtype=data.dtype)
+    slots = stack.reshape(n_programs * n_stack, data.shape[1])
+
+    for op, arg, lo, hi, where in calls:
+        if lo is not None:
+            run_uniform(op, arg, where, stack[lo:hi], data)
+            continue
+        top = where
+        if op == PUSH:
+            slots[top + 1] = np.take(data, arg, axis=0)
+        elif op in UNARY_IMPL:
+            values = np.take(slots, top, axis=0)
+            slots[top] = UNARY_IMPL[op](values, out=values)
+        else:
+            values = np.take(slots, top - 1, axis=0)
+            slots[top - 1] = BINARY_IMPL[op](values, np.take(slots, top, axis=0), out=values)
+
+    return stack[:, 0]
+
+
+def evaluate_mse(code, args, depths, data, y, block_rows=BLOCK_ROWS):
+    """MSE of every program. Up to CHUNK_PROGRAMS programs run in lockstep
+    over blocks of block_rows rows, summing the squared errors per block, so
+    the value stack of a chunk holds block_rows rows. A chunk issues at most
+    MAX_RUNS + 1 calls per opcode and step on every block, so up to
+    CHUNK_PROGRAMS programs the number of NumPy calls grows with the
+    expression length and the number of rows, not with the number of
+    programs. Programs are sorted by
+    length and then by code, so chunks carry little padding and programs
+    running the same opcodes sit next to each other."""
+    n_rows = data.shape[1]
+    lengths = np.count_nonzero(code, axis=1)
+    order = np.lexsort([*code.T[::-1], lengths])
+    sse = np.zeros(len(code))
+
+    for i in range(0, len(order), CHUNK_PROGRAMS):
+        sel = order[i:i + CHUNK_PROGRAMS]
+        n_steps = int(lengths[sel].max())
+        n_stack = int(depths[sel].max())
+        calls = schedule(code[sel, :n_steps], args[sel, :n_steps], n_stack)
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            preds = run(calls, len(sel), n_stack, data[:, start:stop])
+            preds -= y[start:stop]
+            sse[sel] += np.einsum("ij,ij->i", preds, preds)
+
+    return sse / n_rows
@@ -0,0 +1,270 @@
+import argparse
+import math
+import os
+import random
+import time
+from functools import partial
+
+import numpy as np
+
+from expressions import NP_OPS, parse, depth, canonical, to_source, random_program
+from expression_dag import CSE_CACHE_BYTES, ExpressionDAG, LRUCache
+from fused_codegen import FUSED_NP_OPS, torch_fused_ops, compile_batch
+from shape_buckets import bucketize, bucket_mse
+from columnar import load_columns
+from precision import PRECISIONS
+from cost_model import MODEL_FILE, CostModel
+
+# Engines that can score a generation held in memory, and that the search
+# chooses from with the cost model.
+SEARCH_ENGINES = ["cpu", "fused_numpy", "fused_torch", "buckets_numpy", "buckets_torch"]
+DEFAULT_ENGINE = "fused_numpy"
+
+FUSED_BATCH = 32
+
+POPULATION = 500
+GENERATIONS = 20
+INIT_DEPTH = 4
+MUTATION_DEPTH = 2
+MAX_DEPTH = 6
+TOURNAMENT = 5
+CROSSOVER = 0.7
+MUTATION = 0.2
+ELITE = 2
+
+
+class FitnessEvaluator:
+    """MSE of batches of trees against y, with the dataset loaded once and
+    kept in memory (on the device, for the torch engines) across calls. The
+    engine is a key of SEARCH_ENGINES; every call is one batched evaluation
+    through it and returns a float64 NumPy array."""
+
+    def __init__(self, X, engine=DEFAULT_ENGINE, precision="float64"):
+        self.engine = engine
+        self.family, _, backend = engine.partition("_")
+        self.torch = backend == "torch"
+        X = {c: np.asarray(v, dtype=PRECISIONS[precision]) for c, v in X.items()}
+        self.columns = [c for c in X if c != "y"]
+        self.n_rows = len(X["y"])
+
+        if self.torch:
+            import torch
+            torch.set_grad_enabled(False)
+            self.tensors = torch
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            self.dtype = getattr(torch, precision)
+            self.ops = torch_fused_ops()
+            self.X = {c: torch.tensor(v, device=self.device) for c, v in X.items()}
+            self.data = torch.stack([self.X[c] for c in self.columns])
+        else:
+            self.dtype = PRECISIONS[precision]
+            self.ops = FUSED_NP_OPS
+            self.X = X
+            self.data = np.stack([X[c] for c in self.columns])
+        self.y = self.X["y"]
+
+    def __call__(self, trees):
+        if self.family == "cpu":
+            return self.dag_mse(trees)
+        if self.family == "fused":
+            mse = self.fused_mse(trees)
+        else:
+            mse = self.buckets_mse(trees)
+        return mse.cpu().numpy().astype(np.float64) if self.torch else mse.astype(np.float64)
+
+    def empty(self, *shape):
+        if self.torch:
+            return self.tensors.empty(shape, dtype=self.dtype, device=self.device)
+        return np.empty(shape, dtype=self.dtype)
+
+    def dag_mse(self, trees):
+        """One expression DAG per call, so subexpressions shared by the
+        individuals of a generation are computed once."""
+        dag = ExpressionDAG()
+        cache = LRUCache(CSE_CACHE_BYTES)
+        roots = [dag.add(tree) for tree in trees]
+        mse = np.empty(len(trees))
+        for i, root in enumerate(roots):
+            pred = dag.evaluate(root, self.X, NP_OPS, cache)
+            mse[i] = np.square(np.subtract(pred, self.y)).mean()
+        return mse
+
+    def fused_mse(self, trees):
+        batches = [compile_batch(trees[i:i + FUSED_BATCH]) for i in range(0, len(trees), FUSED_BATCH)]
+        scratch = self.empty(max(1, max(n for _, n in batches)), self.n_rows)
+        out = self.empty(FUSED_BATCH, self.n_rows)
+        mse = self.empty(len(trees))
+        for b, (kernel, _) in enumerate(batches):
+            i = b * FUSED_BATCH
+            preds = out[:min(FUSED_BATCH, len(trees) - i)]
+            kernel(self.X, self.ops, scratch, preds)
+            if self.torch:
+                preds.sub_(self.y).square_()
+                self.tensors.mean(preds, dim=1, out=mse[i:i + len(preds)])
+            else:
+                np.subtract(preds, self.y, out=preds)
+                np.square(preds, out=preds)
+                np.mean(preds, axis=1, out=mse[i:i + len(preds)])
+        return mse
+
+    def buckets_mse(self, trees):
+        buckets = bucketize(trees, self.columns)
+        if self.torch:
+            buckets = [b.to(partial(self.tensors.as_tensor, device=self.device)) for b in buckets]
+        return bucket_mse(buckets, self.data, self.y, self.ops, self.empty(len(trees)))
+
+
+def choose_engine(n_rows, population, model_file=MODEL_FILE):
+    """Engine of SEARCH_ENGINES the cost model predicts to be fastest for one
+    generation, or DEFAULT_ENGINE if the model has not been calibrated."""
+    if not os.path.exists(model_file):
+        return DEFAULT_ENGINE
+    mean_depth = (2 + INIT_DEPTH) / 2
+    return CostModel.load(model_file).choose(n_rows, population, mean_depth, SEARCH_ENGINES)[0]
+
+
+def fitness_key(tree):
+    """Identifies an individual up to the order of the operands of +."""
+    return to_source(canonical(tree))
+
+
+def nodes(node, path=()):
+    """(path, subtree) of every node in preorder, a path being the indices
+    into the tuples on the way down."""
+    yield path, node
+    if node[0] == "un":
+        yield from nodes(node[2], path + (2,))
+    elif node[0] == "bin":
+        yield from nodes(node[2], path + (2,))
+        yield from nodes(node[3], path + (3,))
+
+
+def replace(node, path, subtree):
+    if not path:
+        return subtree
+    i = path[0]
+    return node[:i] + (replace(node[i], path[1:], subtree),) + node[i + 1:]
+
+
+def random_tree(max_depth, rng, columns):
+    return parse(random_program(max_depth, rng, columns))
+
+
+def mutate(tree, rng, columns):
+    """Replaces a random subtree with a new random one."""
+    path, _ = rng.choice(list(nodes(tree)))
+    return replace(tree, path, random_tree(rng.randint(0, MUTATION_DEPTH), rng, columns))
+
+
+def crossover(tree, donor, rng):
+    """Replaces a random subtree of tree with a random subtree of donor."""
+    path, _ = rng.choice(list(nodes(tree)))
+    _, subtree = rng.choice(list(nodes(donor)))
+    return replace(tree, path, subtree)
+
+
+def tournament(population, fitness, rng, size=TOURNAMENT):
+    """Best of size individuals drawn without replacement, or of the whole
+    population if it is smaller."""
+    entrants = rng.sample(range(len(population)), min(size, len(population)))
+    return population[min(entrants, key=fitness.__getitem__)]
+
+
+def next_generation(population, fitness, rng, columns, max_depth=MAX_DEPTH):
+    """The ELITE best individuals, then children of tournament winners made by
+    crossover, mutation or reproduction. A child deeper than max_depth is
+    replaced by its first parent."""
+    ranked = sorted(range(len(population)), key=fitness.__getitem__)
+    children = [population[i] for i in ranked[:ELITE]]
+    while len(children) < len(population):
+        parent = tournament(population, fitness, rng)
+        r = rng.random()
+        if r < CROSSOVER:
+            child = crossover(parent, tournament(population, fitness, rng), rng)
+        elif r < CROSSOVER + MUTATION:
+            child = mutate(parent, rng, columns)
+        else:
+            child = parent
+        children.append(child if depth(child) <= max_depth else parent)
+    return children
+
+
+def search(evaluator, population=POPULATION, generations=GENERATIONS, seed=0, log=print):
+    """Genetic programming over the random_program grammar. Every generation is
+    scored in one call of evaluator, with only the individuals that are not
+    in the fitness cache yet; the cache is keyed by fitness_key and kept
+    across generations. Returns the best (mse, expression) found and the
+    statistics of every generation."""
+    rng = random.Random(seed)
+    columns = evaluator.columns
+    scores = {}
+    individuals = [random_tree(rng.randint(2, INIT_DEPTH), rng, columns) for _ in range(population)]
+    history = []
+
+    for generation in range(generations):
+        keys = [fitness_key(tree) for tree in individuals]
+        new = {}
+        for key, tree in zip(keys, individuals):
+            if key not in scores:
+                new.setdefault(key, tree)
+
+        start = time.perf_counter_ns()
+        if new:
+            scores.update(zip(new, evaluator(list(new.values())).tolist()))
+        seconds = (time.perf_counter_ns() - start) / 1e9
+
+        # NaN (the square root of a negative number) ranks last.
+        fitness = [math.inf if math.isnan(scores[k]) else scores[k] for k in keys]
+        best = min(range(population), key=fitness.__getitem__)
+        stats = {
+            "generation": generation,
+            "evaluated": len(new),
+            "cache_hits": population - len(new),
+            "seconds": seconds,
+            "evals_per_second": len(new) / seconds if seconds > 0 else math.inf,
+            "best_mse": fitness[best],
+            "best": to_source(individuals[best])
+        }
+        history.append(stats)
+        log(f"  gen {generation:>3}: {stats['evaluated']:>5,} evaluated, {stats['cache_hits']:>5,} cached, "
+            f"{stats['evals_per_second']:>12,.0f} evals/s, best {stats['best_mse']:.6e}  {stats['best']}")
+
+        if generation < generations - 1:
+            individuals = next_generation(individuals, fitness, rng, columns)
+
+    best_mse, best_expr = min((s["best_mse"], s["best"]) for s in history)
+    return (best_mse, best_expr), history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Symbolic regression by genetic programming on a test case")
+    parser.add_argument("test_case", help="e.g. medium_complex")
+    parser.add_argument("--population", type=int, default=POPULATION)
+    parser.add_argument("--generations", type=int, default=GENERATIONS)
+    parser.add_argument("--engine", choices=SEARCH_ENGINES, default=None,
+                        help=f"default: the fastest according to {MODEL_FILE}, else {DEFAULT_ENGINE}")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="float64")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.population < 1 or args.generations < 1:
+        parser.error("--population and --generations must be at least 1")
+
+    X = load_columns(f"test_cases/data_{args.test_case}.csv")
+    engine = args.engine or choose_engine(len(X["y"]), args.population)
+    evaluator = FitnessEvaluator(X, engine, args.precision)
+    print(f"Searching {args.test_case} ({len(X['y']):,} rows) with {args.population:,} individuals "
+          f"for {args.generations} generations, scored by {engine}")
+
+    start = time.perf_counter_ns()
+    (best_mse, best_expr), history = search(evaluator, args.population, args.generations, args.seed)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+
+    evaluated = sum(s["evaluated"] for s in history)
+    scoring = sum(s["seconds"] for s in history)
+    print(f"Best: {best_mse:.6e}  {best_expr}")
+    print(f"{evaluated:,} of {args.population * args.generations:,} individuals evaluated "
+          f"({evaluated / scoring:,.0f} evals/s while scoring), {elapsed:.3f}s in total")
+
+
+if __name__ == "__main__":
+    main()